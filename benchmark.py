@@ -0,0 +1,437 @@
+import argparse
+import csv
+import hashlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+from busqueda import CANDIDATOS_LEXICOS, MotorBusqueda, fusion_rrf, indice_lexico, terminos
+from catalogo import MESES_ES, Snapshot, cargar_todos_los_proyectos, filtrar_consulta
+from compilado import cargar_compilado, compilar
+from embeddings import BackendEmbeddings, EmbeddingsLocales, texto_embedding
+from fichas import ficha_proyecto
+from navegacion import TAM_PAGINA, codificar_lista, paginar, token_lista
+from teclados import boton_mes, boton_pais, boton_proyecto, teclado_menu, teclado_paginado
+
+log = logging.getLogger(__name__)
+
+# ===========================
+# BENCHMARK SINTÉTICO DEL PIPELINE DE BÚSQUEDA
+# ===========================
+# python benchmark.py --escalas 10k 100k [1m] --consultas 2000 --salida resultados.json
+#
+# Para cada escala genera (una vez, de forma determinista) un CSV con el
+# mismo esquema que erasmus_projects.csv, mide la carga del catálogo,
+# los embeddings y los índices, y reproduce una mezcla de consultas por las
+# mismas etapas que texto_libre en main.py. Por etapa guarda p50/p95/p99,
+# media, consultas por segundo y pico de memoria (tracemalloc) en JSON,
+# para comparar versiones con --comparar.
+ESCALAS = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# Países y ciudades si no hay un CSV real del que tomarlos
+PAISES_CIUDADES = {
+    'Alemania': ['Berlín', 'Hamburgo', 'Múnich', 'Colonia'],
+    'España': ['Madrid', 'Barcelona', 'Valencia', 'Sevilla'],
+    'Francia': ['París', 'Lyon', 'Marsella', 'Toulouse'],
+    'Italia': ['Roma', 'Milán', 'Nápoles', 'Turín'],
+    'Países Bajos': ['Ámsterdam', 'Róterdam', 'Utrecht'],
+    'Portugal': ['Lisboa', 'Oporto', 'Braga'],
+    'Polonia': ['Varsovia', 'Cracovia', 'Gdansk'],
+    'Grecia': ['Atenas', 'Salónica'],
+}
+TEMAS = [
+    'digital', 'inclusion', 'youth', 'empowerment', 'climate', 'renewable', 'energy',
+    'volunteering', 'voluntariado', 'art', 'music', 'theatre', 'sport', 'health',
+    'entrepreneurship', 'media', 'literacy', 'stem', 'robotics', 'programming',
+    'ecology', 'sustainability', 'heritage', 'culture', 'migration', 'democracy',
+    'leadership', 'gastronomy', 'photography', 'outdoor', 'education', 'gender',
+    'equality', 'mental', 'wellbeing', 'storytelling', 'innovation', 'rural',
+]
+RELLENO = [
+    'the', 'participants', 'will', 'learn', 'through', 'workshops', 'activities', 'and',
+    'team', 'projects', 'with', 'local', 'partners', 'during', 'training', 'course',
+    'exchange', 'non-formal', 'methods', 'skills', 'community', 'international',
+]
+CAMPOS_CSV = ['pais', 'ciudad', 'titulo', 'descripcion', 'fecha_inicio', 'fecha_fin',
+              'requisitos', 'gastos_cubiertos', 'contacto', 'enlace', 'deadline']
+
+
+# ===========================
+# GENERADOR DE CATÁLOGOS
+# ===========================
+def lugares_reales(archivo='erasmus_projects.csv'):
+    """Pares país -> ciudades del CSV real, o PAISES_CIUDADES si no está."""
+    lugares = {}
+    for p in cargar_todos_los_proyectos(archivo):
+        ciudades = lugares.setdefault(p.pais, [])
+        if p.ciudad not in ciudades:
+            ciudades.append(p.ciudad)
+    return lugares or PAISES_CIUDADES
+
+
+def generar_catalogo(filas, ruta, semilla=0, lugares=None):
+    """
+    Escribe en 'ruta' un CSV sintético de 'filas' proyectos con el esquema
+    de erasmus_projects.csv. Misma semilla y tamaño = mismo archivo.
+    """
+    rng = np.random.default_rng(semilla)
+    lugares = sorted((lugares or PAISES_CIUDADES).items())
+    pares = [(pais, ciudad) for pais, ciudades in lugares for ciudad in ciudades]
+    origen = date(2025, 1, 1).toordinal()
+
+    lugar = rng.integers(0, len(pares), filas)
+    inicio = origen + rng.integers(0, 3 * 365, filas)
+    duracion = rng.integers(5, 30, filas)
+    antelacion = rng.integers(10, 90, filas)
+    temas = rng.integers(0, len(TEMAS), (filas, 6))
+    relleno = rng.integers(0, len(RELLENO), (filas, 14))
+    cubiertos = rng.random(filas) < 0.7
+    sin_fecha = rng.random(filas) < 0.01
+
+    tmp = ruta + '.tmp'
+    with open(tmp, 'w', encoding='utf-8', newline='') as f:
+        w = csv.writer(f)
+        w.writerow(CAMPOS_CSV)
+        for i in range(filas):
+            pais, ciudad = pares[lugar[i]]
+            t = [TEMAS[j] for j in temas[i]]
+            palabras = [RELLENO[j] for j in relleno[i]]
+            descripcion = ' '.join(palabras[:7] + t[2:5] + palabras[7:]).capitalize() + '.'
+            ini = date.fromordinal(int(inicio[i]))
+            w.writerow([
+                pais, ciudad,
+                f"{t[0].capitalize()} & {t[1].capitalize()} {('Camp', 'Exchange', 'Training')[i % 3]} {i}",
+                descripcion,
+                '' if sin_fecha[i] else ini.isoformat(),
+                (ini + timedelta(days=int(duracion[i]))).isoformat(),
+                f"Ages 18-30, interest in {t[5]}.",
+                'Sí' if cubiertos[i] else 'No',
+                f"contacto{i % 997}@example.org",
+                f"https://example.org/proyectos/{i}",
+                (ini - timedelta(days=int(antelacion[i]))).isoformat(),
+            ])
+    os.replace(tmp, ruta)
+    return ruta
+
+
+def generar_consultas(snap, n, semilla=0):
+    """
+    Mezcla de consultas realista (país, ciudad + mes, fechas, palabras clave
+    y texto libre) con la forma en que escriben los usuarios.
+    Devuelve [(tipo, texto)], determinista para una semilla.
+    """
+    rng = np.random.default_rng(semilla + 1)
+    paises, ciudades = snap.paises, snap.ciudades
+    elegir = lambda xs: xs[int(rng.integers(len(xs)))]
+
+    def fecha():
+        return date(2025, 1, 1) + timedelta(days=int(rng.integers(0, 3 * 365)))
+
+    def rango():
+        d = fecha()
+        return d.isoformat(), (d + timedelta(days=int(rng.integers(7, 60)))).isoformat()
+
+    plantillas = [
+        (0.15, 'pais', lambda: f"proyectos en {elegir(paises)}"),
+        (0.10, 'ciudad_mes', lambda: f"{elegir(ciudades)} en {elegir(MESES_ES)}"),
+        (0.15, 'pais_palabras', lambda: f"{elegir(TEMAS)} y {elegir(TEMAS)} en {elegir(paises)}"),
+        (0.10, 'rango', lambda: "entre {} y {}".format(*rango())),
+        (0.10, 'pais_rango_palabras', lambda: "{} en {} entre {} y {}".format(elegir(TEMAS), elegir(paises), *rango())),
+        (0.10, 'mes', lambda: f"algo para {elegir(MESES_ES)}"),
+        (0.30, 'libre', lambda: f"quiero un proyecto de {elegir(TEMAS)} {elegir(TEMAS)} con {elegir(TEMAS)}"),
+    ]
+    pesos = np.array([p for p, _, _ in plantillas])
+    tipos = rng.choice(len(plantillas), size=n, p=pesos / pesos.sum())
+    return [(plantillas[t][1], plantillas[t][2]()) for t in tipos]
+
+
+# ===========================
+# EMBEDDINGS FALSOS (deterministas)
+# ===========================
+class EmbeddingsFalsos(BackendEmbeddings):
+    """
+    Vector aleatorio de 'dim' componentes sembrado con el hash del texto:
+    el mismo texto da siempre el mismo vector, sin red ni modelo. Solo
+    sirve para medir tiempos y memoria, no la calidad de la búsqueda.
+    """
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.modelo = f"falso-{dim}"
+
+    def codificar(self, textos):
+        matriz = np.empty((len(textos), self.dim), dtype=np.float32)
+        for i, texto in enumerate(textos):
+            semilla = int.from_bytes(hashlib.blake2b(texto.encode('utf-8'), digest_size=8).digest(), 'little')
+            matriz[i] = np.random.default_rng(semilla).standard_normal(self.dim, dtype=np.float32)
+        return matriz
+
+    async def embeber(self, textos):
+        return self.codificar(list(textos))
+
+
+# ===========================
+# MEDICIÓN
+# ===========================
+class Medidor:
+    """Acumula duraciones (y, si se activa, picos de tracemalloc) por etapa."""
+
+    def __init__(self, memoria=False):
+        self.memoria = memoria
+        self.tiempos = {}
+        self.picos = {}
+
+    def medir(self, etapa, funcion, *args):
+        if self.memoria:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+        t0 = time.perf_counter()
+        resultado = funcion(*args)
+        dt = time.perf_counter() - t0
+        if self.memoria:
+            pico = tracemalloc.get_traced_memory()[1] - base
+            self.picos[etapa] = max(self.picos.get(etapa, 0), pico)
+        else:
+            self.tiempos.setdefault(etapa, []).append(dt)
+        return resultado
+
+    def resumen(self, picos=None):
+        picos = picos if picos is not None else self.picos
+        datos = {}
+        for etapa, tiempos in self.tiempos.items():
+            ms = np.array(tiempos) * 1000
+            datos[etapa] = {
+                'n': len(ms),
+                'p50_ms': round(float(np.percentile(ms, 50)), 4),
+                'p95_ms': round(float(np.percentile(ms, 95)), 4),
+                'p99_ms': round(float(np.percentile(ms, 99)), 4),
+                'media_ms': round(float(ms.mean()), 4),
+                'por_segundo': round(len(ms) / (ms.sum() / 1000), 1) if ms.sum() else None,
+                'pico_memoria_mb': round(picos[etapa] / 2**20, 3) if etapa in picos else None,
+            }
+        return datos
+
+
+def procesar_consulta(m, snap, motor, backend, texto):
+    """
+    Una consulta por las etapas de texto_libre (main.py), midiendo cada una:
+    los mismos filtros, búsquedas, teclado de resultados y ficha de detalle
+    que usa el bot; solo cambia el embedding de la consulta (sin red).
+    """
+    t0 = time.perf_counter()
+    entidades = m.medir('extraer', snap.extractor.extraer, texto)
+    filtro = m.medir('filtros', filtrar_consulta, snap, entidades)
+    palabras = entidades['palabras']
+    if filtro is not None:
+        modo, resultados, _ = filtro
+        if palabras:
+            q = m.medir('embedding_consulta', backend.codificar, [" ".join(palabras)])[0]
+            resultados = m.medir('semantico_filtrado', motor.buscar, q, 5, 0.7, list(resultados), False)
+            modo = f'{modo}_sem'
+    else:
+        modo = 'nlp'
+        lexicos = m.medir('bm25', lambda: indice_lexico(snap).buscar(terminos(texto), CANDIDATOS_LEXICOS))
+        q = m.medir('embedding_consulta', backend.codificar, [texto])[0]
+        vectoriales = m.medir('semantico', motor.buscar, q, 5, 0.7, None, False)
+        resultados = vectoriales
+        if lexicos:
+            resultados = m.medir('fusion_rrf', lambda: fusion_rrf(lexicos, vectoriales)[:len(vectoriales)])
+    proyectos = snap.proyectos_de(resultados)
+    m.medir('teclado_resultados', teclado_resultados, modo, proyectos)
+    if proyectos:
+        m.medir('ficha', ficha_proyecto, snap, proyectos[0])
+    m.medir('teclado_menu', teclado_menu, snap, 'mp', snap.paises, boton_pais, 0)
+    if not m.memoria:
+        m.tiempos.setdefault('total', []).append(time.perf_counter() - t0)
+
+
+def teclado_resultados(modo, proyectos):
+    """Primera página de resultados como en main.teclado_resultados (sin guardar la sesión)."""
+    token = token_lista([p.id for p in proyectos]) if len(proyectos) > TAM_PAGINA else ''
+    return teclado_paginado(
+        proyectos, 0,
+        lambda n: codificar_lista(modo, '', n, token),
+        lambda p: boton_proyecto(modo, p)
+    )
+
+
+def construir_indice_lexico(snap):
+    """indice_lexico desde cero (sin el de la caché del snapshot)."""
+    snap.cache.pop('bm25', None)
+    return indice_lexico(snap)
+
+
+def construir_menus(snap):
+    """Todas las páginas de los menús de países y de meses, desde cero."""
+    for menu, elementos, boton in (('mp', snap.paises, boton_pais), ('mm', snap.meses_menu, boton_mes)):
+        n_paginas = paginar(len(elementos), 0)[3]
+        for pagina in range(n_paginas):
+            snap.cache.pop((menu, pagina), None)
+            teclado_menu(snap, menu, elementos, boton, pagina)
+
+
+def una_vez(resultados, etapa, funcion, *args):
+    """
+    Mide una etapa que se ejecuta una sola vez: primero el tiempo y luego,
+    repitiéndola con tracemalloc (que la ralentiza), el pico de memoria.
+    """
+    t0 = time.perf_counter()
+    valor = funcion(*args)
+    dt = time.perf_counter() - t0
+    tracemalloc.start()
+    funcion(*args)
+    pico = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    resultados[etapa] = {'ms': round(dt * 1000, 2), 'pico_memoria_mb': round(pico / 2**20, 2)}
+    log.info("  %-20s %10.1f ms  %8.1f MB", etapa, dt * 1000, pico / 2**20)
+    return valor
+
+
+def ejecutar_escala(filas, args):
+    ruta_csv = os.path.join(args.directorio, f"catalogo-{filas}-s{args.semilla}.csv")
+    if not os.path.exists(ruta_csv):
+        log.info("Generando %s", ruta_csv)
+        generar_catalogo(filas, ruta_csv, args.semilla, lugares_reales())
+
+    carga = {}
+    log.info("Escala %d filas", filas)
+    snap = una_vez(carga, 'carga_csv', lambda: Snapshot(cargar_todos_los_proyectos(ruta_csv), 1, None))
+    ruta_snap = os.path.splitext(ruta_csv)[0] + '.snap'
+    compilar(snap, ruta_snap)
+    snap = una_vez(carga, 'carga_compilada', cargar_compilado, ruta_snap, 1, None)
+
+    backend = EmbeddingsLocales(dim=args.dim) if args.embeddings == 'local' else EmbeddingsFalsos(args.dim)
+    textos = [texto_embedding(p) for p in snap.proyectos]
+    matriz = una_vez(carga, 'embeddings_catalogo', backend.codificar, textos)
+    del textos
+    motor = una_vez(carga, 'motor', lambda: MotorBusqueda(
+        matriz, ids=[p.id for p in snap.proyectos], precision=args.precision, dim=args.dim_compacta
+    ))
+    una_vez(carga, 'indice_bm25', construir_indice_lexico, snap)
+    una_vez(carga, 'menus', construir_menus, snap)
+
+    consultas = generar_consultas(snap, args.consultas, args.semilla)
+    for _, texto in consultas[:args.calentamiento]:
+        procesar_consulta(Medidor(), snap, motor, backend, texto)
+
+    medidor = Medidor()
+    t0 = time.perf_counter()
+    for _, texto in consultas:
+        procesar_consulta(medidor, snap, motor, backend, texto)
+    duracion = time.perf_counter() - t0
+
+    # Picos de memoria en una pasada aparte: tracemalloc distorsiona los tiempos
+    memoria = Medidor(memoria=True)
+    tracemalloc.start()
+    for _, texto in consultas[:args.consultas_memoria]:
+        procesar_consulta(memoria, snap, motor, backend, texto)
+    tracemalloc.stop()
+
+    etapas = medidor.resumen(memoria.picos)
+    for etapa, d in etapas.items():
+        log.info("  %-20s p50 %8.3f  p95 %8.3f  p99 %8.3f ms  (%d)",
+                 etapa, d['p50_ms'], d['p95_ms'], d['p99_ms'], d['n'])
+    tipos = {}
+    for tipo, _ in consultas:
+        tipos[tipo] = tipos.get(tipo, 0) + 1
+    return {
+        'filas': len(snap),
+        'consultas': len(consultas),
+        'mezcla': tipos,
+        'consultas_por_segundo': round(len(consultas) / duracion, 1),
+        'carga': carga,
+        'etapas': etapas,
+        'pico_rss_mb': pico_rss_mb(),
+    }
+
+
+def pico_rss_mb():
+    """Pico de memoria residente del proceso (None si el sistema no lo expone)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+
+def version_codigo():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True,
+                              text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def comparar(actual, ruta_anterior):
+    """Imprime, por escala y etapa, el cambio de p50/p95 respecto a un JSON anterior."""
+    with open(ruta_anterior, 'r', encoding='utf-8') as f:
+        anterior = json.load(f)
+    print(f"Comparación con {ruta_anterior} ({anterior.get('version')} -> {actual.get('version')}):")
+    for escala, datos in actual['escalas'].items():
+        previos = anterior.get('escalas', {}).get(escala)
+        if not previos:
+            continue
+        print(f"  {escala} filas")
+        for etapa, d in datos['etapas'].items():
+            p = previos['etapas'].get(etapa)
+            if not p:
+                continue
+            cambios = [
+                f"{k} {p[k]:.3f} -> {d[k]:.3f} ms ({(d[k] / p[k] - 1) * 100:+.0f}%)" if p[k] else f"{k} -"
+                for k in ('p50_ms', 'p95_ms')
+            ]
+            print(f"    {etapa:<20} " + "   ".join(cambios))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark sintético del pipeline de búsqueda.')
+    parser.add_argument('--escalas', nargs='+', default=['10k', '100k'],
+                        help=f"tamaños de catálogo: {', '.join(ESCALAS)} o un número de filas")
+    parser.add_argument('--consultas', type=int, default=2000)
+    parser.add_argument('--consultas-memoria', type=int, default=200,
+                        help='consultas de la pasada con tracemalloc')
+    parser.add_argument('--calentamiento', type=int, default=50)
+    parser.add_argument('--embeddings', choices=('falsos', 'local'), default='falsos')
+    parser.add_argument('--dim', type=int, default=256, help='dimensión de los embeddings')
+    parser.add_argument('--precision', choices=('float32', 'float16', 'int8'), default='float32')
+    parser.add_argument('--dim-compacta', type=int, default=None)
+    parser.add_argument('--semilla', type=int, default=0)
+    parser.add_argument('--directorio', default='benchmark_datos', help='CSV generados (se reutilizan)')
+    parser.add_argument('--salida', default='benchmark_resultados.json')
+    parser.add_argument('--comparar', help='JSON de una ejecución anterior')
+    args = parser.parse_args(argv)
+    os.makedirs(args.directorio, exist_ok=True)
+
+    resultado = {
+        'version': version_codigo(),
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'plataforma': platform.platform(),
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'comparar', 'directorio')},
+        'escalas': {},
+    }
+    for escala in args.escalas:
+        filas = ESCALAS.get(escala.lower()) or int(escala)
+        resultado['escalas'][str(filas)] = ejecutar_escala(filas, args)
+
+    with open(args.salida, 'w', encoding='utf-8') as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False)
+    log.info("Resultados en %s", args.salida)
+    if args.comparar:
+        comparar(resultado, args.comparar)
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    sys.exit(main())
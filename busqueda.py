@@ -0,0 +1,484 @@
+import numpy as np
+
+from catalogo import normalizar, tokenizar
+
+UMBRAL_SIMILITUD = 0.7
+
+# ===========================
+# MOTOR DE BÚSQUEDA VECTORIAL
+# ===========================
+def normalizar_filas(matriz):
+    """Devuelve la matriz en float32 con cada fila de norma 1 (las filas nulas quedan a 0)."""
+    m = np.asarray(matriz, dtype=np.float32)
+    if m.ndim != 2 or m.shape[0] == 0:
+        return m.reshape(0, m.shape[-1] if m.ndim == 2 else 0)
+    normas = np.linalg.norm(m, axis=1, keepdims=True)
+    normas[normas == 0] = 1.0
+    return m / normas
+
+
+# ===========================
+# MATRIZ COMPACTA (float16 / int8)
+# ===========================
+PRECISIONES = ('float32', 'float16', 'int8')
+
+
+class MatrizCompacta:
+    """
+    Copia reducida de una matriz de filas normalizadas para la primera
+    pasada de la búsqueda:
+      - opcionalmente truncada a las primeras 'dim' componentes (y vuelta
+        a normalizar; los modelos text-embedding-3 admiten recortarse así),
+      - en float16 (2 bytes por valor) o en int8 con una escala por fila
+        (1 byte por valor, cuantización simétrica a [-127, 127]).
+    Se comporta como una matriz float32 de solo lectura: matriz[filas]
+    devuelve las filas ya descomprimidas y 'matriz @ q' calcula por bloques
+    sin descomprimir todo a la vez. La consulta se recorta igual (preparar).
+    """
+
+    BLOQUE = 16_384
+    BLOQUE_PRODUCTO = 256
+
+    def __init__(self, matriz, precision='float16', dim=None):
+        if precision not in ('float16', 'int8'):
+            raise ValueError(f"Precisión no soportada: {precision!r}")
+        self.precision = precision
+        n, d = matriz.shape
+        self.dim = min(dim or d, d)
+        self.datos = np.empty((n, self.dim), dtype=np.float16 if precision == 'float16' else np.int8)
+        self.escalas = np.ones(n, dtype=np.float32)
+        for i in range(0, n, self.BLOQUE):
+            bloque = normalizar_filas(np.asarray(matriz[i:i + self.BLOQUE], dtype=np.float32)[:, :self.dim])
+            if precision == 'float16':
+                self.datos[i:i + self.BLOQUE] = bloque
+            else:
+                escala = np.abs(bloque).max(axis=1) / 127
+                escala[escala == 0] = 1.0
+                self.datos[i:i + self.BLOQUE] = np.rint(bloque / escala[:, None])
+                self.escalas[i:i + self.BLOQUE] = escala
+
+    @property
+    def shape(self):
+        return self.datos.shape
+
+    @property
+    def nbytes(self):
+        return self.datos.nbytes + (self.escalas.nbytes if self.precision == 'int8' else 0)
+
+    def __len__(self):
+        return self.datos.shape[0]
+
+    def __getitem__(self, filas):
+        bloque = self.datos[filas].astype(np.float32)
+        if self.precision == 'int8':
+            bloque *= self.escalas[filas][..., None]
+        return bloque
+
+    def preparar(self, q):
+        """Consulta recortada a 'dim' y normalizada, en float32."""
+        q = np.asarray(q, dtype=np.float32)[:self.dim]
+        norma = np.linalg.norm(q)
+        return q / norma if norma else q
+
+    def __matmul__(self, q):
+        # Bloques pequeños: la copia float32 de cada uno cabe en caché.
+        # En int8 la escala se aplica al resultado, no a la matriz.
+        q = np.asarray(q, dtype=np.float32)
+        sims = np.empty(len(self), dtype=np.float32)
+        paso = self.BLOQUE_PRODUCTO
+        for i in range(0, len(self), paso):
+            sims[i:i + paso] = self.datos[i:i + paso].astype(np.float32) @ q
+        if self.precision == 'int8':
+            sims *= self.escalas
+        return sims
+
+
+# ===========================
+# ÍNDICE APROXIMADO (IVF con k-means)
+# ===========================
+# Por debajo de este número de proyectos la búsqueda exacta es más rápida
+# que cualquier índice; por encima, MotorBusqueda construye un IndiceIVF.
+MINIMO_ANN = 20_000
+SONDEOS_ANN = 8
+
+
+def asignar_centroides(matriz, centroides, bloque=16_384):
+    """Centroide más similar (producto escalar) de cada fila, por bloques para acotar memoria."""
+    asignacion = np.empty(matriz.shape[0], dtype=np.int32)
+    for i in range(0, matriz.shape[0], bloque):
+        asignacion[i:i + bloque] = np.argmax(matriz[i:i + bloque] @ centroides.T, axis=1)
+    return asignacion
+
+
+def kmeans_esferico(matriz, k, iteraciones=10, semilla=0):
+    """
+    k-means sobre filas de norma 1 usando similitud coseno.
+    Devuelve los k centroides normalizados.
+    """
+    rng = np.random.default_rng(semilla)
+    centroides = matriz[rng.choice(matriz.shape[0], size=k, replace=False)].copy()
+    for _ in range(iteraciones):
+        asignacion = asignar_centroides(matriz, centroides)
+        sumas = np.zeros_like(centroides)
+        np.add.at(sumas, asignacion, matriz)
+        vacios = np.flatnonzero(~sumas.any(axis=1))
+        if vacios.size:
+            # Listas vacías: se recolocan en filas al azar
+            sumas[vacios] = matriz[rng.choice(matriz.shape[0], size=vacios.size, replace=False)]
+        centroides = normalizar_filas(sumas)
+    return centroides
+
+
+class IndiceIVF:
+    """
+    Índice de listas invertidas: las filas se reparten entre 'n_listas'
+    centroides (k-means esférico sobre una muestra) y una consulta solo
+    se compara con las filas de los 'n_sondeos' centroides más cercanos.
+    n_sondeos es el control de recall/latencia: con n_sondeos = n_listas
+    la búsqueda es exacta. Las filas de cada lista se guardan contiguas
+    en 'orden', con la lista l en orden[inicios[l]:inicios[l + 1]].
+    """
+
+    def __init__(self, matriz, centroides, asignacion, n_sondeos=SONDEOS_ANN):
+        self.centroides = centroides
+        self.asignacion = asignacion
+        self.n_sondeos = n_sondeos
+        self.orden = np.argsort(asignacion, kind='stable').astype(np.int64)
+        self.inicios = np.searchsorted(asignacion[self.orden], np.arange(len(centroides) + 1))
+
+    @classmethod
+    def construir(cls, matriz, n_listas=None, n_sondeos=SONDEOS_ANN, iteraciones=10,
+                  muestra_por_lista=64, semilla=0):
+        """Entrena los centroides sobre una muestra de 'matriz' y asigna todas las filas."""
+        n = matriz.shape[0]
+        n_listas = min(n, n_listas or max(1, int(np.sqrt(n))))
+        rng = np.random.default_rng(semilla)
+        tam_muestra = min(n, n_listas * muestra_por_lista)
+        muestra = matriz[np.sort(rng.choice(n, size=tam_muestra, replace=False))]
+        centroides = kmeans_esferico(muestra, n_listas, iteraciones, semilla)
+        return cls(matriz, centroides, asignar_centroides(matriz, centroides), n_sondeos)
+
+    @classmethod
+    def actualizar(cls, matriz, previo, reutilizar, n_sondeos=None):
+        """
+        Reconstrucción incremental tras recargar el catálogo: conserva los
+        centroides de 'previo' y solo asigna las filas nuevas o cambiadas.
+        'reutilizar[i]' es la fila de 'previo' que corresponde a la fila i
+        (mismo proyecto y mismo vector), o -1.
+        """
+        asignacion = np.empty(matriz.shape[0], dtype=np.int32)
+        viejas = reutilizar >= 0
+        asignacion[viejas] = previo.asignacion[reutilizar[viejas]]
+        nuevas = np.flatnonzero(~viejas)
+        if nuevas.size:
+            asignacion[nuevas] = asignar_centroides(matriz[nuevas], previo.centroides)
+        return cls(matriz, previo.centroides, asignacion,
+                   previo.n_sondeos if n_sondeos is None else n_sondeos)
+
+    def __len__(self):
+        return len(self.centroides)
+
+    def candidatos(self, q, n_sondeos=None):
+        """Filas de las 'n_sondeos' listas cuyo centroide es más similar a 'q'."""
+        n_sondeos = min(n_sondeos or self.n_sondeos, len(self.centroides))
+        sims = self.centroides @ q
+        if n_sondeos < len(sims):
+            listas = np.argpartition(-sims, n_sondeos - 1)[:n_sondeos]
+        else:
+            listas = np.arange(len(sims))
+        return np.concatenate([self.orden[self.inicios[l]:self.inicios[l + 1]] for l in listas])
+
+
+class MotorBusqueda:
+    """
+    Mantiene una única matriz float32 normalizada con los embeddings del
+    catálogo (fila i = proyecto con 'idx' i). La similitud coseno con una
+    consulta es un solo producto matriz-vector, y el top-k se obtiene con
+    argpartition en lugar de ordenar todo.
+
+    A partir de 'minimo_ann' filas se construye además un IndiceIVF y las
+    búsquedas sobre todo el catálogo solo puntúan las filas de las listas
+    sondeadas ('n_sondeos' regula recall frente a latencia). Las búsquedas
+    restringidas a 'filas' (tras un filtro manual) siguen siendo exactas.
+    Si se pasa el motor 'previo' y los 'ids' de proyecto de cada fila, el
+    índice se reconstruye de forma incremental (ver IndiceIVF.actualizar).
+
+    Con precision='float16'/'int8' (y/o 'dim' para truncar), 'matriz' es una
+    MatrizCompacta: la primera pasada puntúa la copia reducida y después
+    se recalculan con los vectores originales ('embeddings', que puede ser
+    un mmap y no se copia a memoria) los 'recalcular' mejores candidatos y
+    todos los que quedan cerca del umbral. El orden y el umbral se deciden
+    con esas similitudes exactas.
+    """
+
+    # Si cambia más de esta fracción de filas, se reentrenan los centroides
+    MAX_CAMBIO_INCREMENTAL = 0.3
+    # Filas por bloque al comparar con el motor anterior (memoria acotada)
+    BLOQUE_COMPARACION = 4096
+    # Candidatos por debajo del umbral (en la pasada compacta) que aún se recalculan
+    MARGEN_RECALCULO = 0.02
+
+    def __init__(self, embeddings, ids=None, previo=None,
+                 minimo_ann=MINIMO_ANN, n_sondeos=SONDEOS_ANN,
+                 precision='float32', dim=None, recalcular=100):
+        if precision not in PRECISIONES:
+            raise ValueError(f"Precisión no soportada: {precision!r} (opciones: {', '.join(PRECISIONES)})")
+        self.recalcular = recalcular
+        if precision == 'float32' and dim is None:
+            self.matriz = normalizar_filas(embeddings)
+            self._exacta = self._normas = None
+        else:
+            self._exacta = embeddings
+            self._normas = np.concatenate([
+                np.linalg.norm(np.asarray(embeddings[i:i + MatrizCompacta.BLOQUE], dtype=np.float32), axis=1)
+                for i in range(0, len(embeddings), MatrizCompacta.BLOQUE)
+            ] or [np.zeros(0, dtype=np.float32)])
+            self._normas[self._normas == 0] = 1.0
+            self.matriz = MatrizCompacta(embeddings, precision, dim)
+        self.ids = None if ids is None else np.asarray(ids, dtype=np.int64)
+        self.indice = None
+        if len(self) >= minimo_ann:
+            self.indice = self._construir_indice(previo, n_sondeos)
+
+    def _construir_indice(self, previo, n_sondeos):
+        if (previo is not None and previo.indice is not None and self.ids is not None
+                and previo.ids is not None and previo.matriz.shape[1] == self.matriz.shape[1]):
+            reutilizar = self._filas_sin_cambios(previo)
+            if np.mean(reutilizar < 0) <= self.MAX_CAMBIO_INCREMENTAL:
+                return IndiceIVF.actualizar(self.matriz, previo.indice, reutilizar, n_sondeos)
+        return IndiceIVF.construir(self.matriz, n_sondeos=n_sondeos)
+
+    def _filas_sin_cambios(self, previo):
+        """Para cada fila, la fila de 'previo' con el mismo ID y el mismo vector, o -1."""
+        if not len(previo.ids):
+            return np.full(len(self.ids), -1, dtype=np.int64)
+        orden = np.argsort(previo.ids, kind='stable')
+        pos = np.searchsorted(previo.ids[orden], self.ids)
+        pos = np.minimum(pos, len(orden) - 1)
+        reutilizar = orden[pos]
+        mismos = previo.ids[reutilizar] == self.ids
+        # Por bloques: de golpe se copiarían las dos matrices enteras y se
+        # crearía una máscara de n × dim (unos 4 GB con 300k filas de 1536)
+        candidatas = np.flatnonzero(mismos)
+        for a in range(0, len(candidatas), self.BLOQUE_COMPARACION):
+            filas = candidatas[a:a + self.BLOQUE_COMPARACION]
+            mismos[filas] = (previo.matriz[reutilizar[filas]] == self.matriz[filas]).all(axis=1)
+        return np.where(mismos, reutilizar, -1)
+
+    def __len__(self):
+        return self.matriz.shape[0]
+
+    @property
+    def compacto(self):
+        return self._exacta is not None
+
+    def _consulta(self, vector):
+        """'vector' normalizado en el espacio de 'matriz' (recortado si es compacta)."""
+        if self.compacto:
+            return self.matriz.preparar(vector)
+        q = np.asarray(vector, dtype=np.float32)
+        norma = np.linalg.norm(q)
+        return q / norma if norma else q
+
+    def similitudes(self, vector, filas=None):
+        """
+        Coseno entre 'vector' y cada fila del catálogo, o solo de 'filas'
+        (array de índices o máscara booleana de tamaño len(self)).
+        Con matriz compacta es la similitud aproximada de la primera pasada.
+        """
+        q = self._consulta(vector)
+        if filas is None:
+            return self.matriz @ q
+        return self.matriz[filas] @ q
+
+    def buscar(self, vector, top_k=5, umbral=UMBRAL_SIMILITUD, filas=None, limitar=True,
+               n_sondeos=None, exacto=False):
+        """
+        Devuelve índices del catálogo ordenados por similitud descendente:
+          - los que superan 'umbral' (como mucho top_k si limitar=True),
+          - o, si ninguno lo supera, los top_k más similares.
+        'filas' restringe la búsqueda a un subconjunto (filtros manuales).
+        Sin 'filas', y con índice IVF, solo se puntúan las listas sondeadas
+        (salvo exacto=True); el umbral y el top_k se aplican igual.
+        """
+        if filas is None and self.indice is not None and not exacto:
+            candidatos = self.indice.candidatos(self._consulta(vector), n_sondeos)
+            if candidatos.size >= top_k:
+                filas = np.sort(candidatos)
+        if filas is None:
+            ids = None
+        else:
+            ids = np.asarray(filas)
+            if ids.dtype == bool:
+                ids = np.flatnonzero(ids)
+            if ids.size == 0:
+                return []
+        sims = self.similitudes(vector, ids)
+        if sims.size == 0:
+            return []
+        if self.compacto:
+            ids, sims = self._recalcular(vector, ids, sims, top_k, umbral)
+
+        candidatos = np.flatnonzero(sims >= umbral)
+        if candidatos.size == 0:
+            candidatos = self._top(sims, np.arange(sims.size), top_k)
+        elif limitar:
+            candidatos = self._top(sims, candidatos, top_k)
+        orden = candidatos[np.argsort(-sims[candidatos], kind='stable')]
+        if ids is not None:
+            orden = ids[orden]
+        return orden.tolist()
+
+    def _recalcular(self, vector, ids, sims, top_k, umbral):
+        """
+        Segunda pasada: similitud exacta, con los vectores originales, de
+        los mejores candidatos de la pasada compacta. Devuelve (filas, sims).
+        """
+        todos = np.arange(sims.size)
+        seleccion = np.union1d(
+            np.flatnonzero(sims >= umbral - self.MARGEN_RECALCULO),
+            self._top(sims, todos, max(top_k, self.recalcular))
+        )
+        filas = seleccion if ids is None else ids[seleccion]
+        q = np.asarray(vector, dtype=np.float32)
+        norma = np.linalg.norm(q)
+        if norma:
+            q = q / norma
+        exactas = (np.asarray(self._exacta[filas], dtype=np.float32) @ q) / self._normas[filas]
+        return filas, exactas
+
+    @staticmethod
+    def _top(sims, candidatos, k):
+        """Los k candidatos de mayor similitud (sin ordenar), vía argpartition."""
+        if candidatos.size <= k:
+            return candidatos
+        parte = np.argpartition(-sims[candidatos], k - 1)[:k]
+        return np.sort(candidatos[parte])
+
+
+# ===========================
+# BÚSQUEDA LÉXICA LOCAL (BM25)
+# ===========================
+# Campos de cada proyecto que entran en el índice léxico
+CAMPOS_BM25 = ('titulo', 'descripcion', 'requisitos')
+# Los tokens más cortos (artículos, preposiciones...) no se indexan,
+# igual que las palabras clave del extractor de entidades.
+MIN_LONGITUD_TERMINO = 3
+# Palabras vacías (ya normalizadas) de 3+ caracteres en español e inglés,
+# más las muletillas de las consultas ("busco un proyecto..."): no se
+# indexan ni se buscan, porque casarían con casi cualquier proyecto.
+PALABRAS_VACIAS = frozenset("""
+    que los las del con para por una uno unos unas sus les como mas pero sin sobre
+    entre hasta desde este esta estos estas ese esa eso esto hay muy tambien donde
+    cuando quiero busco buscar buscando encontrar algun alguna algo proyecto proyectos
+    the and for with that this from are was were you your our their into about any
+    all can has have not but its who what which want looking find project projects
+""".split())
+# Puntuación mínima de un resultado léxico: absoluta (descarta coincidencias
+# solo en términos que aparecen en casi todo el catálogo) y relativa a la del
+# mejor resultado de la consulta.
+PUNTUACION_MINIMA_BM25 = 1.0
+FRACCION_MEJOR_BM25 = 0.5
+# Búsqueda híbrida en toda la base: candidatos léxicos que entran en la
+# fusión RRF y cuántos se muestran mientras llega la reordenación vectorial
+CANDIDATOS_LEXICOS = 50
+TOP_K_LEXICOS = 5
+
+
+def terminos(texto):
+    """Términos de búsqueda de un texto: tokens normalizados de 3+ caracteres, sin palabras vacías."""
+    return [t for t in tokenizar(normalizar(texto))
+            if len(t) >= MIN_LONGITUD_TERMINO and t not in PALABRAS_VACIAS]
+
+
+class IndiceBM25:
+    """
+    Índice invertido con puntuación BM25 sobre título, descripción y
+    requisitos. Cada término guarda dos arrays (filas donde aparece y
+    frecuencia en cada una), así que puntuar una consulta solo recorre
+    las listas de sus términos. No necesita red: sirve para responder al
+    instante y dejar los embeddings para reordenar.
+    """
+
+    def __init__(self, documentos, k1=1.5, b=0.75):
+        """'documentos': lista de listas de términos, una por fila del catálogo."""
+        self.k1 = k1
+        self.b = b
+        self.n = len(documentos)
+        longitudes = np.array([len(d) for d in documentos], dtype=np.float32)
+        media = float(longitudes.mean()) if self.n and longitudes.sum() else 1.0
+        # Parte de la normalización por longitud que no depende del término
+        self._norma = k1 * (1 - b + b * longitudes / media)
+
+        postings = {}
+        for fila, doc in enumerate(documentos):
+            frecuencias = {}
+            for t in doc:
+                frecuencias[t] = frecuencias.get(t, 0) + 1
+            for t, f in frecuencias.items():
+                postings.setdefault(t, ([], []))
+                postings[t][0].append(fila)
+                postings[t][1].append(f)
+        self._postings = {
+            t: (np.array(filas, dtype=np.int32), np.array(frec, dtype=np.float32))
+            for t, (filas, frec) in postings.items()
+        }
+
+    @classmethod
+    def desde_proyectos(cls, proyectos, **kwargs):
+        return cls([terminos(" ".join(p[c] for c in CAMPOS_BM25)) for p in proyectos], **kwargs)
+
+    def __len__(self):
+        return len(self._postings)
+
+    def idf(self, termino):
+        filas = self._postings.get(termino)
+        df = 0 if filas is None else len(filas[0])
+        return float(np.log1p((self.n - df + 0.5) / (df + 0.5)))
+
+    def puntuar(self, consulta):
+        """Puntuación BM25 de cada fila para los términos de 'consulta' (array de tamaño n)."""
+        puntos = np.zeros(self.n, dtype=np.float32)
+        for t in dict.fromkeys(consulta):
+            entrada = self._postings.get(t)
+            if entrada is None:
+                continue
+            filas, frec = entrada
+            puntos[filas] += self.idf(t) * frec * (self.k1 + 1) / (frec + self._norma[filas])
+        return puntos
+
+    def buscar(self, consulta, top_k=50, filas=None, minimo=PUNTUACION_MINIMA_BM25,
+               fraccion=FRACCION_MEJOR_BM25):
+        """
+        Índices del catálogo para 'consulta' (lista de términos) con
+        puntuación de al menos 'minimo' y 'fraccion' de la mejor, de mayor
+        a menor, como mucho 'top_k'. 'filas' restringe la búsqueda a un
+        subconjunto, como en MotorBusqueda.buscar.
+        """
+        puntos = self.puntuar(consulta)
+        if filas is not None:
+            mascara = np.zeros(self.n, dtype=bool)
+            mascara[np.asarray(filas)] = True
+            puntos[~mascara] = 0
+        umbral = max(minimo, fraccion * float(puntos.max())) if self.n else 0.0
+        candidatos = np.flatnonzero((puntos > 0) & (puntos >= umbral))
+        if top_k is not None and candidatos.size > top_k:
+            candidatos = MotorBusqueda._top(puntos, candidatos, top_k)
+        return candidatos[np.argsort(-puntos[candidatos], kind='stable')].tolist()
+
+
+def indice_lexico(snap):
+    """Índice BM25 del snapshot; se construye la primera vez que se pide."""
+    return snap.memo('bm25', lambda: IndiceBM25.desde_proyectos(snap.proyectos))
+
+
+def fusion_rrf(*rankings, k=60):
+    """
+    Reciprocal Rank Fusion: combina varias listas de índices ordenadas
+    sumando 1 / (k + posición) de cada una. Devuelve la lista fusionada.
+    """
+    puntos = {}
+    for ranking in rankings:
+        for pos, i in enumerate(ranking):
+            puntos[i] = puntos.get(i, 0.0) + 1.0 / (k + pos + 1)
+    return sorted(puntos, key=lambda i: -puntos[i])
@@ -0,0 +1,561 @@
+import csv
+import hashlib
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+from datetime import date, datetime
+
+log = logging.getLogger(__name__)
+
+# ===========================
+# NORMALIZACIÓN DE TEXTO
+# ===========================
+def normalizar(texto: str) -> str:
+    """
+    Convierte texto a minúsculas y quita tildes/acentos.
+    Ejemplo: "Róterdam" -> "rotterdam"
+    """
+    nfkd = unicodedata.normalize("NFKD", texto)
+    return "".join(c for c in nfkd if not unicodedata.combining(c)).lower()
+
+MESES_ES = [
+    "enero", "febrero", "marzo", "abril", "mayo", "junio",
+    "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"
+]
+MESES_NORMAL = [normalizar(m) for m in MESES_ES]
+
+# ===========================
+# REGISTRO COMPACTO DE PROYECTO
+# ===========================
+CAMPOS_TEXTO = ('pais', 'ciudad', 'titulo', 'descripcion',
+                'requisitos', 'gastos_cubiertos', 'contacto', 'enlace')
+
+
+class Proyecto:
+    """
+    Un proyecto del catálogo. Usa __slots__ en lugar de un dict por fila,
+    comparte (sys.intern) las cadenas que se repiten entre filas, como país,
+    ciudad o gastos cubiertos, y guarda las fechas como ordinales enteros
+    (0 = sin fecha). fecha_inicio, fecha_fin y deadline las devuelven como
+    datetime.date o None. p['campo'] equivale a p.campo, para el código
+    que trataba los proyectos como diccionarios.
+    """
+    __slots__ = ('pais', 'ciudad', 'titulo', 'descripcion', 'requisitos',
+                 'gastos_cubiertos', 'contacto', 'enlace',
+                 'ord_inicio', 'ord_fin', 'ord_deadline', 'idx', 'id')
+
+    def __init__(self, pais, ciudad, titulo, descripcion, fecha_inicio, fecha_fin,
+                 requisitos='', gastos_cubiertos='', contacto='', enlace='', deadline=None):
+        self.pais = sys.intern(pais)
+        self.ciudad = sys.intern(ciudad)
+        self.titulo = titulo
+        self.descripcion = descripcion
+        self.requisitos = requisitos
+        self.gastos_cubiertos = sys.intern(gastos_cubiertos)
+        self.contacto = contacto
+        self.enlace = enlace
+        self.ord_inicio = fecha_inicio.toordinal() if fecha_inicio else 0
+        self.ord_fin = fecha_fin.toordinal() if fecha_fin else 0
+        self.ord_deadline = deadline.toordinal() if deadline else 0
+        self.idx = -1
+        self.id = 0
+
+    @classmethod
+    def desde_columnas(cls, textos, ord_inicio, ord_fin, ord_deadline):
+        """
+        Proyecto a partir de sus 8 campos de texto (en el orden de CAMPOS_TEXTO)
+        y sus fechas ya como ordinales, sin volver a parsear nada.
+        """
+        p = cls.__new__(cls)
+        (p.pais, p.ciudad, p.titulo, p.descripcion,
+         p.requisitos, p.gastos_cubiertos, p.contacto, p.enlace) = textos
+        p.pais = sys.intern(p.pais)
+        p.ciudad = sys.intern(p.ciudad)
+        p.gastos_cubiertos = sys.intern(p.gastos_cubiertos)
+        p.ord_inicio, p.ord_fin, p.ord_deadline = ord_inicio, ord_fin, ord_deadline
+        p.idx = -1
+        p.id = 0
+        return p
+
+    @property
+    def fecha_inicio(self):
+        return date.fromordinal(self.ord_inicio) if self.ord_inicio else None
+
+    @property
+    def fecha_fin(self):
+        return date.fromordinal(self.ord_fin) if self.ord_fin else None
+
+    @property
+    def deadline(self):
+        return date.fromordinal(self.ord_deadline) if self.ord_deadline else None
+
+    def __getitem__(self, campo):
+        try:
+            return getattr(self, campo)
+        except AttributeError:
+            raise KeyError(campo) from None
+
+    def __repr__(self):
+        return f"Proyecto({self.titulo!r}, {self.ciudad!r}, {self.pais!r})"
+
+# ===========================
+# CARGAR PROYECTOS DESDE CSV (fechas en ISO)
+# ===========================
+def _fecha_iso(texto):
+    try:
+        return datetime.strptime(texto, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def cargar_todos_los_proyectos(archivo='erasmus_projects.csv'):
+    """
+    Lee un CSV con columnas:
+      pais,ciudad,titulo,descripcion,fecha_inicio,fecha_fin,
+      requisitos,gastos_cubiertos,contacto,enlace,deadline
+    (fechas en formato ISO YYYY-MM-DD).
+    Devuelve lista de Proyecto (ver arriba) con:
+      - texto (str)
+      - fecha_inicio, fecha_fin, deadline como datetime.date o None
+    """
+    proyectos = []
+    if not os.path.exists(archivo):
+        return proyectos
+
+    with open(archivo, 'r', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for fila in reader:
+            proyectos.append(Proyecto(
+                pais=fila['pais'].strip(),
+                ciudad=fila['ciudad'].strip(),
+                titulo=fila['titulo'].strip(),
+                descripcion=fila['descripcion'].strip(),
+                fecha_inicio=_fecha_iso(fila['fecha_inicio']),
+                fecha_fin=_fecha_iso(fila['fecha_fin']),
+                requisitos=(fila.get('requisitos') or '').strip(),
+                gastos_cubiertos=(fila.get('gastos_cubiertos') or '').strip(),
+                contacto=(fila.get('contacto') or '').strip(),
+                enlace=(fila.get('enlace') or '').strip(),
+                deadline=_fecha_iso(fila['deadline'])
+            ))
+    return proyectos
+
+# ===========================
+# ID ESTABLE DE PROYECTO
+# ===========================
+def id_estable(p):
+    """
+    Entero de 63 bits derivado de los campos que identifican un proyecto
+    (título, país, ciudad, fecha de inicio y enlace). No cambia entre
+    recargas del CSV aunque se reordenen filas o se edite la descripción.
+    """
+    clave = "\x1f".join((p.titulo, p.pais, p.ciudad, str(p.fecha_inicio), p.enlace))
+    return int.from_bytes(hashlib.sha1(clave.encode('utf-8')).digest()[:8], 'big') >> 1
+
+# ===========================
+# EXTRACTOR DE ENTIDADES (países, ciudades, meses, fechas)
+# ===========================
+PATRON_TOKENS = re.compile(r'(\d{4}-\d{2}-\d{2})|(\w+)')
+PATRON_FECHA = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def tokenizar(texto_norm):
+    """Divide un texto ya normalizado en tokens; las fechas ISO son un único token."""
+    return [m.group(0) for m in PATRON_TOKENS.finditer(texto_norm)]
+
+
+class ExtractorEntidades:
+    """
+    Trie de tokens con los nombres normalizados de países, ciudades y
+    meses, construido una vez por Snapshot. extraer() recorre el mensaje
+    una sola vez, quedándose en cada posición con la coincidencia más
+    larga (así "nueva york" o "paises bajos" se reconocen enteros), y
+    devuelve además las fechas ISO y las palabras clave sobrantes.
+    """
+    _FIN = object()  # marca de nombre completo dentro del trie
+
+    def __init__(self, paises, ciudades, meses=MESES_ES):
+        self._raiz = {}
+        for tipo, nombres in (('pais', paises), ('ciudad', ciudades), ('mes', meses)):
+            for nombre in nombres:
+                tokens = tokenizar(normalizar(nombre))
+                if not tokens:
+                    continue
+                nodo = self._raiz
+                for t in tokens:
+                    nodo = nodo.setdefault(t, {})
+                nodo.setdefault(self._FIN, {}).setdefault(tipo, nombre)
+
+    def extraer(self, texto):
+        """
+        Devuelve un dict con las listas 'paises', 'ciudades', 'meses'
+        (nombres reales, en orden de aparición), 'fechas' (YYYY-MM-DD)
+        y 'palabras' (tokens restantes de al menos 3 caracteres).
+        """
+        res = {'paises': [], 'ciudades': [], 'meses': [], 'fechas': [], 'palabras': []}
+        # Las fechas se buscan en el mensaje crudo antes de partirlo en
+        # palabras, para no perder las pegadas a letras ("2025-06-01y2025-07-01")
+        res['fechas'] = PATRON_FECHA.findall(texto)
+        tokens = tokenizar(normalizar(PATRON_FECHA.sub(' ', texto)))
+        claves = {'pais': 'paises', 'ciudad': 'ciudades', 'mes': 'meses'}
+        i, n = 0, len(tokens)
+        while i < n:
+            tok = tokens[i]
+            # Coincidencia más larga que empieza en i
+            nodo, j, fin, encontrado = self._raiz, i, i, None
+            while j < n and tokens[j] in nodo:
+                nodo = nodo[tokens[j]]
+                j += 1
+                if self._FIN in nodo:
+                    fin, encontrado = j, nodo[self._FIN]
+            if encontrado:
+                for tipo, nombre in encontrado.items():
+                    if nombre not in res[claves[tipo]]:
+                        res[claves[tipo]].append(nombre)
+                i = fin
+                continue
+            if len(tok) >= 3:
+                res['palabras'].append(tok)
+            i += 1
+        return res
+
+# ===========================
+# SNAPSHOT INMUTABLE DEL CATÁLOGO
+# ===========================
+class Snapshot:
+    """
+    Foto inmutable del CSV en un instante dado. Todos los handlers
+    comparten la misma instancia hasta que el catálogo se recarga;
+    los proyectos no deben modificarse. Cada proyecto lleva en 'idx'
+    su posición en el snapshot (y en la matriz de embeddings) y en 'id'
+    un identificador estable entre recargas (ver id_estable).
+
+    Al construirse prepara índices invertidos (listas de 'idx' ya
+    ordenadas por fecha_inicio) por país, ciudad, mes y (año, mes),
+    así que filtrar cuesta lo que mide el resultado. Además guarda los
+    proyectos ordenados por fecha_inicio y por deadline junto a sus
+    fechas ordinales, para resolver rangos con dos búsquedas binarias.
+
+    'motor' es el motor de búsqueda semántica de este snapshot; lo crea
+    main.py la primera vez que se necesita.
+
+    'cache' guarda lo que se deriva del snapshot y se pide muchas veces
+    (fichas de proyecto ya renderizadas, teclados de menús...); al recargar
+    el catálogo se crea otro snapshot y esa caché se descarta con él.
+
+    Si el snapshot viene de un catálogo compilado (ver compilado.py),
+    'precalculado' trae los IDs y los órdenes por fecha ya resueltos, y
+    'embeddings' la matriz de embeddings alineada con 'idx' (o None).
+    """
+    __slots__ = ('proyectos', 'version', 'firma', 'cargado_en', 'motor', 'por_id',
+                 'paises', 'ciudades', 'por_pais', 'por_ciudad', 'por_mes', 'por_anio_mes', 'meses_menu',
+                 'orden_inicio', 'ordinales_inicio', 'orden_deadline', 'ordinales_deadline',
+                 'extractor', 'cache', 'embeddings', 'modelo_embeddings')
+
+    def __init__(self, proyectos, version, firma, precalculado=None):
+        precalculado = precalculado or {}
+        self.por_id = {}
+        if 'ids' in precalculado:
+            for i, (p, pid) in enumerate(zip(proyectos, precalculado['ids'])):
+                p.idx = i
+                p.id = pid
+                self.por_id[pid] = i
+        else:
+            for i, p in enumerate(proyectos):
+                p.idx = i
+                pid = id_estable(p)
+                while pid in self.por_id:  # filas duplicadas: siguiente ID libre
+                    pid += 1
+                p.id = pid
+                self.por_id[pid] = i
+        self.proyectos = tuple(proyectos)
+        self.version = version
+        self.firma = firma
+        self.cargado_en = time.time()
+        self.motor = None
+        self.cache = {}
+        self.embeddings = None
+        self.modelo_embeddings = None
+        self._indexar(precalculado.get('orden_inicio'), precalculado.get('orden_deadline'))
+
+    def __len__(self):
+        return len(self.proyectos)
+
+    def _indexar(self, orden_inicio=None, orden_deadline=None):
+        por_pais, por_ciudad, por_mes, por_anio_mes = {}, {}, {}, {}
+        if orden_inicio is None:
+            # sorted() es estable: a igual fecha se respeta el orden del CSV.
+            # Se ordena por el ordinal entero, sin crear objetos date.
+            sin_fecha = date.max.toordinal()
+            orden = sorted(self.proyectos, key=lambda p: p.ord_inicio or sin_fecha)
+        else:
+            orden = [self.proyectos[i] for i in orden_inicio]
+        anio_mes = {}  # ordinal -> (año, mes); muchas filas comparten fecha
+        for p in orden:
+            i = p.idx
+            por_pais.setdefault(p.pais, []).append(i)
+            por_ciudad.setdefault(p.ciudad, []).append(i)
+            if p.ord_inicio:
+                am = anio_mes.get(p.ord_inicio)
+                if am is None:
+                    f = p.fecha_inicio
+                    am = anio_mes[p.ord_inicio] = (f.year, f.month)
+                por_mes.setdefault(am[1], []).append(i)
+                por_anio_mes.setdefault(am, []).append(i)
+        self.por_pais = {k: tuple(v) for k, v in por_pais.items()}
+        self.por_ciudad = {k: tuple(v) for k, v in por_ciudad.items()}
+        self.por_mes = {k: tuple(v) for k, v in por_mes.items()}
+        self.por_anio_mes = {k: tuple(v) for k, v in sorted(por_anio_mes.items())}
+        # (año, mes, etiqueta) de cada mes con proyectos, en orden cronológico
+        self.meses_menu = tuple(
+            (anio, mes, date(anio, mes, 1).strftime("%B %Y")) for anio, mes in self.por_anio_mes
+        )
+        self.paises = sorted(self.por_pais)
+        self.ciudades = sorted(self.por_ciudad)
+        self.extractor = ExtractorEntidades(self.paises, self.ciudades)
+
+        con_inicio = [p for p in orden if p.ord_inicio]
+        self.orden_inicio = tuple(p.idx for p in con_inicio)
+        self.ordinales_inicio = array('l', (p.ord_inicio for p in con_inicio))
+        if orden_deadline is None:
+            con_deadline = sorted((p for p in self.proyectos if p.ord_deadline), key=lambda p: p.ord_deadline)
+        else:
+            con_deadline = [self.proyectos[i] for i in orden_deadline]
+        self.orden_deadline = tuple(p.idx for p in con_deadline)
+        self.ordinales_deadline = array('l', (p.ord_deadline for p in con_deadline))
+
+    def memo(self, clave, construir):
+        """Valor de 'clave' en la caché del snapshot; lo crea con construir() la primera vez."""
+        try:
+            return self.cache[clave]
+        except KeyError:
+            valor = self.cache[clave] = construir()
+            return valor
+
+    # ---------------------------
+    # Consultas sobre los índices
+    # ---------------------------
+    def proyecto_por_id(self, pid):
+        """Proyecto con ID estable 'pid', o None si ya no está en el catálogo."""
+        i = self.por_id.get(pid)
+        return None if i is None else self.proyectos[i]
+
+    def proyectos_de(self, indices):
+        """Lista de proyectos para una secuencia de 'idx'."""
+        return [self.proyectos[i] for i in indices]
+
+    @staticmethod
+    def interseccion(*listas):
+        """
+        Intersección de listas de 'idx' respetando el orden de la primera
+        (todas vienen ordenadas por fecha_inicio, así que el resultado también).
+        """
+        if not listas:
+            return []
+        resultado = listas[0]
+        for otra in listas[1:]:
+            if len(otra) < len(resultado):
+                conjunto = set(resultado)
+                resultado = [i for i in otra if i in conjunto]
+            else:
+                conjunto = set(otra)
+                resultado = [i for i in resultado if i in conjunto]
+        return list(resultado)
+
+    def indices_pais(self, pais):
+        return self.por_pais.get(pais, ())
+
+    def indices_ciudad(self, ciudad):
+        return self.por_ciudad.get(ciudad, ())
+
+    def indices_mes(self, mes_norm):
+        """Índices cuyo mes de inicio es 'mes_norm' (nombre en español sin tildes)."""
+        try:
+            return self.por_mes.get(MESES_NORMAL.index(mes_norm) + 1, ())
+        except ValueError:
+            return ()
+
+    def indices_anio_mes(self, anio, mes):
+        return self.por_anio_mes.get((anio, mes), ())
+
+    def indices_rango(self, inicio, fin):
+        """Índices cuya fecha_inicio está entre 'inicio' y 'fin' (inclusive), por fecha."""
+        a = bisect_left(self.ordinales_inicio, inicio.toordinal())
+        b = bisect_right(self.ordinales_inicio, fin.toordinal())
+        return self.orden_inicio[a:b]
+
+    def indices_deadline(self, desde, hasta):
+        """Índices cuya deadline está entre 'desde' y 'hasta' (inclusive), por deadline."""
+        a = bisect_left(self.ordinales_deadline, desde.toordinal())
+        b = bisect_right(self.ordinales_deadline, hasta.toordinal())
+        return self.orden_deadline[a:b]
+
+# ===========================
+# FILTROS MANUALES DE UNA CONSULTA (pasos 1-4 de texto_libre)
+# ===========================
+def filtrar_consulta(snap, entidades):
+    """
+    Aplica a las 'entidades' de un mensaje (ExtractorEntidades.extraer)
+    los filtros manuales, en este orden, y se queda con el primero que
+    da resultados:
+      1) Fechas + País/Ciudad
+      2) Fechas solamente
+      3) País/Ciudad + Mes
+      4) País/Ciudad solo o Mes solo
+    Devuelve (modo, indices, ambito), p.ej. ('pais', (...), 'en Alemania'),
+    o None si ninguno da resultados y la consulta pasa al paso 5
+    (búsqueda en toda la base). Los 'indices' vienen ordenados por fecha_inicio.
+    """
+    pais = entidades['paises'][0] if entidades['paises'] else None
+    ciudad = entidades['ciudades'][0] if entidades['ciudades'] else None
+    mes = entidades['meses'][0] if entidades['meses'] else None
+    lugar = pais or ciudad
+    if pais:
+        base = snap.indices_pais(pais)
+    elif ciudad:
+        base = snap.indices_ciudad(ciudad)
+
+    # Rango de fechas YYYY-MM-DD (si hay al menos 2 coincidencias)
+    fechas = entidades['fechas']
+    rango = None
+    if len(fechas) >= 2:
+        try:
+            rango = (datetime.strptime(fechas[0], '%Y-%m-%d').date(),
+                     datetime.strptime(fechas[1], '%Y-%m-%d').date())
+        except ValueError:
+            rango = None
+
+    if rango:
+        en_rango = snap.indices_rango(*rango)
+        # 1) Intersección con el rango (ambos ya ordenados por fecha_inicio)
+        if lugar:
+            filtrados = snap.interseccion(base, en_rango)
+            if filtrados:
+                return 'rango', filtrados, f"en {lugar} entre {fechas[0]} y {fechas[1]}"
+        # 2) Fechas solamente
+        if en_rango:
+            return 'rango', en_rango, f"entre {fechas[0]} y {fechas[1]}"
+
+    # 3) País/Ciudad + Mes
+    if lugar and mes:
+        filtrados = snap.interseccion(base, snap.indices_mes(normalizar(mes)))
+        if filtrados:
+            return 'pais_mes', filtrados, f"en {lugar} durante {mes}"
+
+    # 4a) País o Ciudad solo
+    if lugar and base:
+        return ('pais' if pais else 'ciudad'), base, f"en {lugar}"
+
+    # 4b) Mes solo
+    if mes:
+        filtrados = snap.indices_mes(normalizar(mes))
+        if filtrados:
+            return 'mes', filtrados, f"en {mes}"
+    return None
+
+# ===========================
+# CATÁLOGO CON RECARGA EN CALIENTE
+# ===========================
+class Catalogo:
+    """
+    Parsea el CSV una sola vez y lo mantiene en memoria como Snapshot.
+    Si existe un catálogo compilado ('archivo_compilado', por defecto el
+    CSV con extensión .snap) más reciente que el CSV, se carga de ahí sin
+    parsear nada; si no, o si no se puede leer, se usa el CSV.
+    Cada llamada a actual() comprueba (como mucho cada 'intervalo'
+    segundos) el mtime/tamaño del archivo y, si ha cambiado, construye
+    un Snapshot nuevo y lo sustituye de forma atómica. También se puede
+    forzar con recargar() o pedirla con solicitar_recarga() (p.ej. desde SIGHUP).
+    """
+
+    def __init__(self, archivo='erasmus_projects.csv', intervalo=2.0, archivo_compilado=None):
+        self.archivo = archivo
+        self.archivo_compilado = archivo_compilado or os.path.splitext(archivo)[0] + '.snap'
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._ultima_comprobacion = 0.0
+        self._recarga_pendiente = False
+        self._snapshot = Snapshot((), 0, None)
+        self.recargas = 0
+        self.ultima_recarga_ms = 0.0
+        self.recargar()
+
+    def _firma_archivo(self):
+        try:
+            st = os.stat(self.archivo)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def recargar(self, forzar=True):
+        """
+        Relee el CSV si su firma cambió (o siempre, si forzar=True)
+        y publica el Snapshot nuevo. Devuelve el Snapshot vigente.
+        """
+        with self._lock:
+            firma = self._firma_archivo()
+            actual = self._snapshot
+            if not forzar and firma == actual.firma:
+                return actual
+            t0 = time.perf_counter()
+            nuevo, origen = None, self.archivo
+            if self._compilado_vigente(firma):
+                # Import diferido: compilado.py depende de este módulo
+                from compilado import cargar_compilado
+                try:
+                    nuevo = cargar_compilado(self.archivo_compilado, actual.version + 1, firma)
+                    origen = self.archivo_compilado
+                except (OSError, ValueError):
+                    log.exception("No se pudo leer %s; se usa el CSV", self.archivo_compilado)
+            if nuevo is None:
+                proyectos = cargar_todos_los_proyectos(self.archivo)
+                nuevo = Snapshot(proyectos, actual.version + 1, firma)
+            self.ultima_recarga_ms = (time.perf_counter() - t0) * 1000
+            self.recargas += 1
+            self._snapshot = nuevo
+            log.info("Catálogo v%d cargado desde %s: %d proyectos en %.1f ms",
+                     nuevo.version, origen, len(nuevo), self.ultima_recarga_ms)
+            return nuevo
+
+    def _compilado_vigente(self, firma):
+        """True si hay catálogo compilado y no es más antiguo que el CSV."""
+        try:
+            mtime = os.stat(self.archivo_compilado).st_mtime_ns
+        except OSError:
+            return False
+        return firma is None or mtime >= firma[0]
+
+    def solicitar_recarga(self):
+        """Marca el catálogo para recargarse en la próxima llamada a actual()."""
+        self._recarga_pendiente = True
+
+    def actual(self):
+        """Devuelve el Snapshot vigente, recargándolo si el CSV cambió."""
+        ahora = time.monotonic()
+        if self._recarga_pendiente:
+            self._recarga_pendiente = False
+            self._ultima_comprobacion = ahora
+            return self.recargar(forzar=True)
+        if ahora - self._ultima_comprobacion >= self.intervalo:
+            self._ultima_comprobacion = ahora
+            if self._firma_archivo() != self._snapshot.firma:
+                return self.recargar(forzar=False)
+        return self._snapshot
+
+    def estadisticas(self):
+        """Métricas básicas: versión, filas, recargas y latencia de la última recarga."""
+        snap = self._snapshot
+        return {
+            'version': snap.version,
+            'filas': len(snap),
+            'recargas': self.recargas,
+            'ultima_recarga_ms': round(self.ultima_recarga_ms, 2),
+            'cargado_en': snap.cargado_en,
+            'entradas_cache': len(snap.cache),
+        }
@@ -0,0 +1,189 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+import numpy as np
+
+from catalogo import CAMPOS_TEXTO, Proyecto, Snapshot, cargar_todos_los_proyectos
+from embeddings import (
+    AlmacenEmbeddings, BACKENDS, EmbeddingsLocales, MMAP_REEMPLAZABLE, MODELO_EMBEDDINGS,
+    directorio_embeddings, texto_embedding,
+)
+
+log = logging.getLogger(__name__)
+
+# ===========================
+# CATÁLOGO COMPILADO (.snap)
+# ===========================
+# Un único archivo binario que se lee con mmap:
+#   - 8 bytes mágicos + longitud (uint64) de una cabecera JSON
+#   - la cabecera: número de filas, modelo de embeddings y, por sección,
+#     su dtype, forma y posición (alineada a 64 bytes)
+#   - secciones:
+#       textos          todos los campos de texto concatenados (UTF-8)
+#       cortes          int64, posición (en caracteres) de cada campo
+#                       dentro de 'textos': fila i, campo k empieza en
+#                       cortes[i*8 + k] y acaba en cortes[i*8 + k + 1]
+#       fechas          int32 (n, 3): ordinales de inicio, fin y deadline
+#       ids             int64, ID estable de cada fila
+#       orden_inicio    int32, filas ordenadas por fecha_inicio
+#       orden_deadline  int32, filas con deadline ordenadas por deadline
+#       embeddings      float32 (n, dim), opcional, fila i = proyecto i
+# Cargarlo no parsea fechas, no calcula hashes ni ordena: solo reparte
+# los textos en Proyecto y pasa IDs y órdenes ya resueltos al Snapshot.
+MAGICO = b'ERASNAP1'
+ALINEACION = 64
+
+
+def _alinear(n):
+    return -(-n // ALINEACION) * ALINEACION
+
+
+def compilar(snap, destino, embeddings=None, modelo=MODELO_EMBEDDINGS):
+    """
+    Escribe 'snap' (y, si se pasa, su matriz de embeddings alineada con
+    'idx') en 'destino'. Se escribe a un .tmp y se sustituye de forma
+    atómica, así que el bot nunca ve un archivo a medias.
+    """
+    proyectos = snap.proyectos
+    textos = [getattr(p, c) for p in proyectos for c in CAMPOS_TEXTO]
+    cortes = np.zeros(len(textos) + 1, dtype=np.int64)
+    np.cumsum([len(t) for t in textos], out=cortes[1:])
+
+    secciones = {
+        'textos': np.frombuffer(''.join(textos).encode('utf-8'), dtype=np.uint8),
+        'cortes': cortes,
+        'fechas': np.array([(p.ord_inicio, p.ord_fin, p.ord_deadline) for p in proyectos],
+                           dtype=np.int32).reshape(len(proyectos), 3),
+        'ids': np.array([p.id for p in proyectos], dtype=np.int64),
+        # Mismo orden que Snapshot._indexar: los que no tienen fecha, al final
+        'orden_inicio': np.array(
+            list(snap.orden_inicio) + [p.idx for p in proyectos if not p.ord_inicio], dtype=np.int32),
+        'orden_deadline': np.array(snap.orden_deadline, dtype=np.int32),
+    }
+    if embeddings is not None:
+        secciones['embeddings'] = np.ascontiguousarray(embeddings, dtype=np.float32)
+
+    cabecera = {'filas': len(proyectos), 'modelo': modelo if embeddings is not None else None,
+                'secciones': {}}
+    # Las posiciones dependen del tamaño de la propia cabecera: se reserva
+    # sitio de sobra y se rellena con espacios.
+    reserva = _alinear(1024 + 128 * len(secciones))
+    posicion = len(MAGICO) + 8 + reserva
+    for nombre, arr in secciones.items():
+        posicion = _alinear(posicion)
+        cabecera['secciones'][nombre] = {
+            'dtype': arr.dtype.str, 'forma': list(arr.shape), 'posicion': posicion,
+        }
+        posicion += arr.nbytes
+    datos_cabecera = json.dumps(cabecera).encode('utf-8')
+    if len(datos_cabecera) > reserva:
+        raise ValueError("Cabecera del catálogo compilado demasiado grande")
+
+    tmp = destino + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGICO)
+        f.write(reserva.to_bytes(8, 'little'))
+        f.write(datos_cabecera.ljust(reserva))
+        for nombre, arr in secciones.items():
+            f.seek(cabecera['secciones'][nombre]['posicion'])
+            f.write(arr.tobytes())
+    os.replace(tmp, destino)
+    return cabecera
+
+
+def leer_secciones(ruta):
+    """Cabecera y vistas (mmap, sin copiar) de cada sección de 'ruta'."""
+    with open(ruta, 'rb') as f:
+        if f.read(len(MAGICO)) != MAGICO:
+            raise ValueError(f"{ruta} no es un catálogo compilado")
+        reserva = int.from_bytes(f.read(8), 'little')
+        cabecera = json.loads(f.read(reserva))
+    mapa = np.memmap(ruta, dtype=np.uint8, mode='r')
+    secciones = {}
+    for nombre, s in cabecera['secciones'].items():
+        dtype = np.dtype(s['dtype'])
+        n = int(np.prod(s['forma'], dtype=np.int64))
+        trozo = mapa[s['posicion']:s['posicion'] + n * dtype.itemsize]
+        secciones[nombre] = trozo.view(dtype).reshape(s['forma'])
+    return cabecera, secciones
+
+
+def cargar_compilado(ruta, version, firma):
+    """Snapshot a partir del catálogo compilado en 'ruta'."""
+    cabecera, sec = leer_secciones(ruta)
+    texto = sec['textos'].tobytes().decode('utf-8')
+    cortes = sec['cortes'].tolist()
+    campos = [texto[a:b] for a, b in zip(cortes, cortes[1:])]
+    ancho = len(CAMPOS_TEXTO)
+    proyectos = [
+        Proyecto.desde_columnas(campos[i * ancho:(i + 1) * ancho], *fila)
+        for i, fila in enumerate(sec['fechas'].tolist())
+    ]
+    if len(proyectos) != cabecera['filas']:
+        raise ValueError(f"{ruta}: número de filas inconsistente")
+    snap = Snapshot(proyectos, version, firma, precalculado={
+        'ids': sec['ids'].tolist(),
+        'orden_inicio': sec['orden_inicio'].tolist(),
+        'orden_deadline': sec['orden_deadline'].tolist(),
+    })
+    if 'embeddings' in sec:
+        # Como en AlmacenEmbeddings.matriz: sin MMAP_REEMPLAZABLE se copia,
+        # para que 'compilar' pueda sustituir el .snap con el bot en marcha
+        snap.embeddings = sec['embeddings'] if MMAP_REEMPLAZABLE else np.array(sec['embeddings'])
+        snap.modelo_embeddings = cabecera['modelo']
+    return snap
+
+
+# ===========================
+# SUBCOMANDO: python main.py compilar
+# ===========================
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='main.py compilar',
+        description='Convierte el CSV de proyectos en un catálogo compilado (.snap) para arrancar sin parsearlo.'
+    )
+    parser.add_argument('csv', nargs='?', default='erasmus_projects.csv')
+    parser.add_argument('-o', '--destino', help='por defecto, el CSV con extensión .snap')
+    parser.add_argument('--cache-embeddings', default='embeddings_cache',
+                        help='almacén de embeddings del que copiar la matriz')
+    parser.add_argument('--sin-embeddings', action='store_true',
+                        help='no incluir la matriz de embeddings')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='openai',
+                        help='backend de embeddings del bot (con "local" se calculan aquí mismo)')
+    args = parser.parse_args(argv)
+    destino = args.destino or os.path.splitext(args.csv)[0] + '.snap'
+
+    if not os.path.exists(args.csv):
+        log.error("No existe %s", args.csv)
+        return 1
+    snap = Snapshot(cargar_todos_los_proyectos(args.csv), 1, None)
+
+    embeddings, modelo = None, MODELO_EMBEDDINGS
+    if not args.sin_embeddings and len(snap):
+        textos = [texto_embedding(p) for p in snap.proyectos]
+        if args.backend == 'local':
+            # El backend local no usa red: se calcula aquí mismo
+            local = EmbeddingsLocales()
+            modelo, embeddings = local.modelo, local.codificar(textos)
+        else:
+            # Solo se copian vectores ya calculados: compilar no llama a la API
+            almacen = AlmacenEmbeddings(directorio_embeddings(args.cache_embeddings, modelo), modelo)
+            faltan = almacen.faltantes(textos)
+            if faltan:
+                log.warning("Faltan %d embeddings en %s; el catálogo compilado no los incluirá "
+                            "(arranca el bot una vez para calcularlos)", len(faltan), args.cache_embeddings)
+            else:
+                embeddings = almacen.matriz(textos)
+
+    compilar(snap, destino, embeddings, modelo)
+    log.info("Catálogo compilado en %s: %d proyectos%s", destino, len(snap),
+             '' if embeddings is None else f', embeddings {embeddings.shape[1]}d')
+    return 0
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,598 @@
+import asyncio
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+from catalogo import normalizar, tokenizar
+
+log = logging.getLogger(__name__)
+
+MODELO_EMBEDDINGS = "text-embedding-3-small"
+
+
+def texto_embedding(p):
+    """Texto fuente del embedding de un proyecto: 'Título. Descripción'."""
+    return f"{p.titulo}. {p.descripcion}"
+
+# ===========================
+# ALMACÉN DE EMBEDDINGS EN DISCO
+# ===========================
+# En Windows no se puede sustituir (os.replace) un archivo que otro objeto
+# aún tiene mapeado en memoria. Allí matriz(mmap=True) devuelve una copia,
+# para que el motor en uso no bloquee la siguiente consolidación.
+MMAP_REEMPLAZABLE = os.name != 'nt'
+
+
+def hash_texto(texto, modelo=MODELO_EMBEDDINGS):
+    """Clave estable de un embedding: hash del modelo + texto fuente."""
+    return hashlib.sha1(f"{modelo}\n{texto}".encode('utf-8')).hexdigest()
+
+
+class AlmacenEmbeddings:
+    """
+    Guarda los embeddings en 'directorio' como:
+      - vectores.npy : matriz float32 (una fila por texto), leída con mmap
+      - indice.json  : {"modelo", "dim", "hashes": [hash de cada fila]}
+      - parcial-*.npz: lotes ya calculados de una construcción en curso
+    Solo se piden a la API los textos cuyo hash no está ya guardado
+    (ni en la matriz ni en un parcial), así que una construcción
+    interrumpida continúa desde el último lote terminado.
+    Si los archivos faltan o no cuadran entre sí, se empieza de cero.
+    """
+
+    def __init__(self, directorio='embeddings_cache', modelo=MODELO_EMBEDDINGS):
+        self.directorio = directorio
+        self.modelo = modelo
+        self.ruta_vectores = os.path.join(directorio, 'vectores.npy')
+        self.ruta_indice = os.path.join(directorio, 'indice.json')
+        self._vectores = None
+        self._filas = {}
+        self._parciales = {}  # hash -> vector, pendientes de consolidar
+        self._cargar()
+        self._cargar_parciales()
+
+    def _cargar(self):
+        try:
+            with open(self.ruta_indice, 'r', encoding='utf-8') as f:
+                indice = json.load(f)
+            vectores = np.load(self.ruta_vectores, mmap_mode='r')
+        except (OSError, ValueError):
+            return
+        hashes = indice.get('hashes', [])
+        if indice.get('modelo') != self.modelo or vectores.ndim != 2 or len(hashes) != vectores.shape[0]:
+            log.warning("Almacén de embeddings inconsistente en %s; se reconstruirá", self.directorio)
+            return
+        self._vectores = vectores
+        self._filas = {h: i for i, h in enumerate(hashes)}
+
+    def _rutas_parciales(self):
+        return sorted(glob.glob(os.path.join(self.directorio, 'parcial-*.npz')))
+
+    def _cargar_parciales(self):
+        for ruta in self._rutas_parciales():
+            try:
+                with np.load(ruta) as datos:
+                    if str(datos['modelo']) != self.modelo:
+                        continue
+                    self._parciales.update(zip(datos['hashes'].tolist(), datos['vectores']))
+            except (OSError, ValueError, KeyError):
+                log.warning("Lote parcial ilegible, se ignora: %s", ruta)
+        if self._parciales:
+            log.info("Reanudando: %d embeddings de lotes parciales", len(self._parciales))
+
+    def __len__(self):
+        return len(self._filas) + len(self._parciales)
+
+    def _guardar(self, hashes, vectores):
+        """Escribe matriz e índice en archivos temporales y los sustituye de golpe."""
+        os.makedirs(self.directorio, exist_ok=True)
+        tmp_vec = self.ruta_vectores + '.tmp'
+        tmp_idx = self.ruta_indice + '.tmp'
+        with open(tmp_vec, 'wb') as f:
+            np.save(f, vectores)
+        with open(tmp_idx, 'w', encoding='utf-8') as f:
+            json.dump({'modelo': self.modelo, 'dim': int(vectores.shape[1]), 'hashes': hashes}, f)
+        self._vectores = None  # soltar el mmap anterior antes de reemplazar el archivo
+        os.replace(tmp_vec, self.ruta_vectores)
+        os.replace(tmp_idx, self.ruta_indice)
+        self._vectores = np.load(self.ruta_vectores, mmap_mode='r')
+        self._filas = {h: i for i, h in enumerate(hashes)}
+
+    def faltantes(self, textos):
+        """Textos (sin repetir, en orden) cuyo embedding aún no está guardado."""
+        faltan = {}
+        for t in textos:
+            h = hash_texto(t, self.modelo)
+            if h not in self._filas and h not in self._parciales and h not in faltan:
+                faltan[h] = t
+        return list(faltan.values())
+
+    def agregar_parcial(self, textos, vectores):
+        """
+        Guarda en un parcial-*.npz propio los 'vectores' de 'textos' (mismo
+        orden). Es barato (no reescribe la matriz) y sobrevive a un corte.
+        """
+        os.makedirs(self.directorio, exist_ok=True)
+        hashes = [hash_texto(t, self.modelo) for t in textos]
+        vectores = np.asarray(vectores, dtype=np.float32)
+        ruta = os.path.join(self.directorio, f'parcial-{time.time_ns()}-{len(self._parciales)}.npz')
+        with open(ruta + '.tmp', 'wb') as f:
+            np.savez(f, modelo=np.array(self.modelo), hashes=np.array(hashes, dtype=str), vectores=vectores)
+        os.replace(ruta + '.tmp', ruta)
+        self._parciales.update(zip(hashes, vectores))
+
+    def consolidar(self, vivos=None):
+        """
+        Vuelca los parciales en la matriz principal y borra sus archivos.
+        Si se pasa 'vivos' (todos los textos del catálogo actual), se
+        descartan las filas que ya no corresponden a ninguno de ellos.
+        """
+        if vivos is None:
+            hashes = list(self._filas) + [h for h in self._parciales if h not in self._filas]
+        else:
+            hashes = list(dict.fromkeys(hash_texto(t, self.modelo) for t in vivos))
+            if not self._parciales and hashes == list(self._filas):
+                return
+        if hashes:
+            matriz = np.stack([
+                self._parciales[h] if h in self._parciales else self._vectores[self._filas[h]]
+                for h in hashes
+            ]).astype(np.float32)
+            self._guardar(hashes, matriz)
+        for ruta in self._rutas_parciales():
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        self._parciales = {}
+
+    def matriz(self, textos, mmap=False):
+        """
+        Matriz float32 con el embedding guardado de cada texto de 'textos'.
+        Con mmap=True, si las filas ya están en ese orden en disco (lo normal
+        tras consolidar(vivos=textos)), devuelve una vista del mmap sin
+        copiarla a memoria; si no (o si el sistema no permite sustituir
+        archivos mapeados, ver MMAP_REEMPLAZABLE), una copia como siempre.
+        """
+        if not textos:
+            return np.zeros((0, 0), dtype=np.float32)
+        if self._parciales:
+            self.consolidar()
+        filas = [self._filas[hash_texto(t, self.modelo)] for t in textos]
+        if (mmap and MMAP_REEMPLAZABLE and filas == list(range(len(filas)))
+                and self._vectores.dtype == np.float32):
+            return self._vectores[:len(filas)]
+        return np.asarray(self._vectores[filas], dtype=np.float32)
+
+    def borrar(self):
+        """Elimina el almacén del disco; la próxima llamada lo reconstruye desde cero."""
+        self._vectores = None
+        for ruta in [self.ruta_vectores, self.ruta_indice] + self._rutas_parciales():
+            try:
+                os.remove(ruta)
+            except OSError:
+                pass
+        self._filas = {}
+        self._parciales = {}
+
+# ===========================
+# CONSTRUCCIÓN POR LOTES (catálogos grandes)
+# ===========================
+MAX_TEXTOS_LOTE = 2048       # límite de inputs por petición de la API
+MAX_TOKENS_LOTE = 200_000    # margen bajo el límite de tokens por petición
+MAX_TOKENS_TEXTO = 8000      # límite de tokens por input del modelo
+
+
+def estimar_tokens(texto):
+    """Estimación conservadora (~3 caracteres por token) sin depender de tiktoken."""
+    return len(texto) // 3 + 1
+
+
+def recortar_texto(texto, max_tokens=MAX_TOKENS_TEXTO):
+    """Recorta 'texto' para que no supere el límite de tokens por input."""
+    if estimar_tokens(texto) <= max_tokens:
+        return texto
+    return texto[:max_tokens * 3]
+
+
+def dividir_en_lotes(textos, max_textos=MAX_TEXTOS_LOTE, max_tokens=MAX_TOKENS_LOTE):
+    """
+    Reparte 'textos' en lotes que respetan a la vez el número máximo de
+    inputs y el presupuesto estimado de tokens por petición.
+    """
+    lotes, lote, tokens = [], [], 0
+    for t in textos:
+        n = min(estimar_tokens(t), MAX_TOKENS_TEXTO)
+        if lote and (len(lote) >= max_textos or tokens + n > max_tokens):
+            lotes.append(lote)
+            lote, tokens = [], 0
+        lote.append(t)
+        tokens += n
+    if lote:
+        lotes.append(lote)
+    return lotes
+
+
+async def construir_embeddings(textos, cliente, almacen, paralelo=4, progreso=None,
+                               max_textos=MAX_TEXTOS_LOTE, max_tokens=MAX_TOKENS_LOTE,
+                               podar=True):
+    """
+    Calcula los embeddings que faltan en 'almacen' para 'textos', en lotes
+    enviados con como mucho 'paralelo' peticiones simultáneas. Cada lote
+    terminado se guarda enseguida como parcial, de modo que si el proceso
+    se corta la siguiente llamada solo pide lo que faltaba. Al final se
+    consolida todo en la matriz; con podar=True se descartan además las
+    filas que ya no están en 'textos' (no debe usarse con un catálogo que
+    no sea el más reciente). 'progreso(hechos, total)' es opcional.
+    """
+    vivos = textos if podar else None
+    pendientes = almacen.faltantes(textos)
+    if not pendientes:
+        almacen.consolidar(vivos=vivos)
+        return
+
+    lotes = dividir_en_lotes(pendientes, max_textos, max_tokens)
+    total = len(pendientes)
+    hechos = 0
+    semaforo = asyncio.Semaphore(paralelo)
+    t0 = time.perf_counter()
+
+    async def procesar(lote):
+        nonlocal hechos
+        async with semaforo:
+            vectores = await cliente.embeber([recortar_texto(t) for t in lote])
+        # Se guarda con el hash del texto completo, no del recortado
+        almacen.agregar_parcial(lote, vectores)
+        hechos += len(lote)
+        log.info("Embeddings: %d/%d (%.0f s)", hechos, total, time.perf_counter() - t0)
+        if progreso:
+            progreso(hechos, total)
+
+    resultados = await asyncio.gather(*(procesar(l) for l in lotes), return_exceptions=True)
+    errores = [r for r in resultados if isinstance(r, BaseException)]
+    if errores:
+        log.error("%d de %d lotes fallaron; lo ya calculado queda guardado", len(errores), len(lotes))
+        raise errores[0]
+    almacen.consolidar(vivos=vivos)
+
+# ===========================
+# BACKENDS DE EMBEDDINGS
+# ===========================
+# Todos exponen 'modelo' (nombre que separa sus vectores en los almacenes y
+# cachés), 'async embeber(textos)' -> matriz float32 y 'embeber_uno(texto)'.
+# Se eligen por nombre con crear_backend() (ver BACKENDS más abajo).
+class BackendEmbeddings:
+    """Interfaz común de los backends de embeddings."""
+    modelo = None
+
+    async def embeber(self, textos):
+        """Devuelve una matriz float32 con el embedding de cada texto de 'textos'."""
+        raise NotImplementedError
+
+    async def embeber_uno(self, texto):
+        """Embedding de un único texto (p.ej. la consulta de un usuario)."""
+        return (await self.embeber([texto]))[0]
+
+
+# ===========================
+# CLIENTE ASÍNCRONO DE EMBEDDINGS (OpenAI)
+# ===========================
+class ClienteEmbeddings(BackendEmbeddings):
+    """
+    Envoltorio asíncrono sobre AsyncOpenAI para no bloquear el bucle de
+    eventos de Telethon mientras se espera a la API. Limita cuántas
+    peticiones hay en vuelo a la vez, corta cada llamada tras 'timeout'
+    segundos y reintenta los errores transitorios con espera exponencial.
+    """
+
+    def __init__(self, api_key, modelo=MODELO_EMBEDDINGS, timeout=20.0,
+                 max_concurrencia=4, reintentos=3, espera_base=0.5):
+        import openai
+        self._openai = openai
+        self._cliente = openai.AsyncOpenAI(api_key=api_key, timeout=timeout, max_retries=0)
+        self.modelo = modelo
+        self.timeout = timeout
+        self.reintentos = reintentos
+        self.espera_base = espera_base
+        self._semaforo = asyncio.Semaphore(max_concurrencia)
+        self.errores_transitorios = (
+            asyncio.TimeoutError,
+            openai.APITimeoutError,
+            openai.APIConnectionError,
+            openai.RateLimitError,
+            openai.InternalServerError,
+        )
+
+    async def embeber(self, textos):
+        """Devuelve una matriz float32 con el embedding de cada texto de 'textos'."""
+        for intento in range(self.reintentos + 1):
+            try:
+                async with self._semaforo:
+                    resp = await asyncio.wait_for(
+                        self._cliente.embeddings.create(model=self.modelo, input=list(textos)),
+                        self.timeout
+                    )
+                return np.array([d.embedding for d in resp.data], dtype=np.float32)
+            except self.errores_transitorios as e:
+                if intento == self.reintentos:
+                    raise
+                espera = self.espera_base * (2 ** intento) * (1 + random.random())
+                log.warning("Error transitorio de embeddings (%s); reintento en %.1f s", e, espera)
+                await asyncio.sleep(espera)
+
+
+@lru_cache(maxsize=200_000)
+def _proyeccion(rasgo, dim, proyecciones):
+    """Posiciones y signos (deterministas) en los que cae un rasgo de texto."""
+    digest = hashlib.blake2b(rasgo.encode('utf-8'), digest_size=4 * proyecciones).digest()
+    valores = np.frombuffer(digest, dtype='<u4')
+    return (valores % dim).astype(np.int64), np.where(valores & (1 << 31), -1.0, 1.0).astype(np.float32)
+
+
+class EmbeddingsLocales(BackendEmbeddings):
+    """
+    Backend local, sin red: cada texto se normaliza y se trocea en palabras
+    (y pares de palabras consecutivas); cada rasgo pesa 1 + log(frecuencia)
+    y se proyecta con un hash estable en 'proyecciones' posiciones con
+    signo aleatorio de un vector de 'dim' componentes (proyección aleatoria
+    dispersa), que al final se normaliza. Es determinista: el mismo texto
+    da siempre el mismo vector, en cualquier máquina.
+
+    No usa IDF para que el vector de un texto no dependa del catálogo (y el
+    almacén por hash de texto siga siendo válido). Sus similitudes no son
+    comparables con las de OpenAI; el umbral 0.7 se aplica igual y, si nada
+    lo supera, se devuelven los top_k como siempre.
+    """
+
+    # Por encima de este número de textos se codifica en un hilo aparte
+    MIN_TEXTOS_HILO = 64
+
+    def __init__(self, dim=384, proyecciones=4, bigramas=True):
+        self.dim = dim
+        self.proyecciones = proyecciones
+        self.bigramas = bigramas
+        self.modelo = f"local-hash-{dim}x{proyecciones}{'-bi' if bigramas else ''}-v1"
+
+    def _rasgos(self, texto):
+        tokens = tokenizar(normalizar(texto))
+        rasgos = {}
+        for t in tokens:
+            rasgos[t] = rasgos.get(t, 0) + 1
+        if self.bigramas:
+            for a, b in zip(tokens, tokens[1:]):
+                rasgos[f"{a} {b}"] = rasgos.get(f"{a} {b}", 0) + 1
+        return rasgos
+
+    def codificar(self, textos):
+        """Versión síncrona de embeber(): matriz float32 (len(textos), dim) con filas de norma 1."""
+        matriz = np.zeros((len(textos), self.dim), dtype=np.float32)
+        for fila, texto in enumerate(textos):
+            rasgos = self._rasgos(texto)
+            if not rasgos:
+                continue
+            proyectados = [_proyeccion(r, self.dim, self.proyecciones) for r in rasgos]
+            posiciones = np.concatenate([p for p, _ in proyectados])
+            pesos = np.repeat(1.0 + np.log(np.fromiter(rasgos.values(), dtype=np.float32, count=len(rasgos))),
+                              self.proyecciones)
+            matriz[fila] = np.bincount(posiciones, np.concatenate([s for _, s in proyectados]) * pesos,
+                                       minlength=self.dim)
+        normas = np.linalg.norm(matriz, axis=1, keepdims=True)
+        normas[normas == 0] = 1.0
+        return matriz / normas
+
+    async def embeber(self, textos):
+        textos = list(textos)
+        if len(textos) >= self.MIN_TEXTOS_HILO:
+            # Lotes grandes (construir el catálogo): sin bloquear el bucle de eventos
+            return await asyncio.to_thread(self.codificar, textos)
+        return self.codificar(textos)
+
+
+BACKENDS = {
+    'openai': ClienteEmbeddings,
+    'local': EmbeddingsLocales,
+}
+
+
+def directorio_embeddings(base, modelo):
+    """
+    Carpeta del almacén de 'modelo': 'base' para el modelo de OpenAI por
+    defecto (compatible con los almacenes existentes) y una subcarpeta
+    por modelo para los demás.
+    """
+    return base if modelo == MODELO_EMBEDDINGS else os.path.join(base, modelo)
+
+
+def crear_backend(nombre='openai', **kwargs):
+    """
+    Backend de embeddings por nombre ('openai' o 'local'); 'kwargs' se pasan
+    a su constructor (p.ej. api_key para OpenAI, dim para el local).
+    """
+    try:
+        clase = BACKENDS[nombre]
+    except KeyError:
+        raise ValueError(f"Backend de embeddings desconocido: {nombre!r} (opciones: {', '.join(BACKENDS)})") from None
+    return clase(**kwargs)
+
+# ===========================
+# CACHÉ DE EMBEDDINGS DE CONSULTAS (LRU + TTL)
+# ===========================
+class CacheConsultas:
+    """
+    Caché acotada de embeddings de consultas, indexada por el texto
+    normalizado (minúsculas, sin tildes, espacios colapsados) y el modelo.
+    Expulsa la entrada menos usada al superar 'max_entradas' y descarta
+    las que tienen más de 'ttl' segundos. Si se indica 'ruta', se puede
+    guardar/cargar de disco (.npz) para sobrevivir a reinicios.
+    """
+
+    def __init__(self, modelo=MODELO_EMBEDDINGS, max_entradas=2000, ttl=7 * 24 * 3600, ruta=None):
+        self.modelo = modelo
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.ruta = ruta
+        self._entradas = OrderedDict()  # clave -> (instante, vector)
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        if ruta:
+            self.cargar()
+
+    def clave(self, texto):
+        return " ".join(normalizar(texto).split())
+
+    def obtener(self, texto):
+        """Devuelve el vector cacheado para 'texto' o None (y cuenta acierto/fallo)."""
+        clave = self.clave(texto)
+        entrada = self._entradas.get(clave)
+        if entrada is not None and time.time() - entrada[0] <= self.ttl:
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+        if entrada is not None:
+            del self._entradas[clave]
+        self.fallos += 1
+        return None
+
+    def poner(self, texto, vector):
+        clave = self.clave(texto)
+        self._entradas[clave] = (time.time(), np.asarray(vector, dtype=np.float32))
+        self._entradas.move_to_end(clave)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+            self.expulsiones += 1
+
+    def __len__(self):
+        return len(self._entradas)
+
+    def estadisticas(self):
+        total = self.aciertos + self.fallos
+        return {
+            'entradas': len(self._entradas),
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'expulsiones': self.expulsiones,
+            'tasa_aciertos': round(self.aciertos / total, 3) if total else 0.0,
+        }
+
+    def guardar(self):
+        """Escribe las entradas vigentes en 'ruta' (si se configuró)."""
+        if not self.ruta:
+            return
+        ahora = time.time()
+        vigentes = [(c, t, v) for c, (t, v) in self._entradas.items() if ahora - t <= self.ttl]
+        directorio = os.path.dirname(self.ruta)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        tmp = self.ruta + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(
+                f,
+                modelo=np.array(self.modelo),
+                claves=np.array([c for c, _, _ in vigentes], dtype=str),
+                instantes=np.array([t for _, t, _ in vigentes], dtype=np.float64),
+                vectores=np.array([v for _, _, v in vigentes], dtype=np.float32),
+            )
+        os.replace(tmp, self.ruta)
+
+    def cargar(self):
+        """Recupera de 'ruta' las entradas no caducadas del mismo modelo."""
+        try:
+            with np.load(self.ruta) as datos:
+                if str(datos['modelo']) != self.modelo:
+                    return
+                claves, instantes, vectores = datos['claves'], datos['instantes'], datos['vectores']
+        except (OSError, ValueError, KeyError):
+            return
+        ahora = time.time()
+        for c, t, v in zip(claves.tolist(), instantes.tolist(), vectores):
+            if ahora - t <= self.ttl:
+                self._entradas[c] = (t, v)
+        while len(self._entradas) > self.max_entradas:
+            self._entradas.popitem(last=False)
+
+# ===========================
+# MICRO-LOTES DE CONSULTAS CONCURRENTES
+# ===========================
+class AgrupadorConsultas:
+    """
+    Junta las consultas que llegan con pocos milisegundos de diferencia
+    y las envía en una sola llamada multi-input a 'cliente.embeber()'.
+    Un lote sale cuando alcanza 'max_lote' textos o cuando pasan
+    'max_espera' segundos desde la primera consulta pendiente; después
+    cada handler recibe su propio vector. Si el lote falla por un error
+    que no es transitorio, sus textos se reenvían uno a uno, para que
+    solo reciba el error la consulta que lo provoca.
+    """
+
+    def __init__(self, cliente, max_lote=32, max_espera=0.01):
+        self.cliente = cliente
+        self.max_lote = max_lote
+        self.max_espera = max_espera
+        self._pendientes = []  # [(texto, future)]
+        self._temporizador = None
+        self._tareas = set()  # envíos en curso (asyncio solo guarda referencias débiles)
+        self.lotes = 0
+        self.textos = 0
+
+    async def embeber_uno(self, texto):
+        if not texto.strip():
+            # La API rechaza los textos vacíos: que no hagan fallar al resto del lote
+            raise ValueError("No se puede calcular el embedding de un texto vacío")
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        self._pendientes.append((texto, futuro))
+        if len(self._pendientes) >= self.max_lote:
+            self._despachar()
+        elif self._temporizador is None:
+            self._temporizador = loop.call_later(self.max_espera, self._despachar)
+        return await futuro
+
+    def _despachar(self):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+            self._temporizador = None
+        while self._pendientes:
+            lote = self._pendientes[:self.max_lote]
+            self._pendientes = self._pendientes[self.max_lote:]
+            tarea = asyncio.ensure_future(self._enviar(lote))
+            self._tareas.add(tarea)
+            tarea.add_done_callback(self._tareas.discard)
+
+    async def _enviar(self, lote):
+        unicos = list(dict.fromkeys(t for t, _ in lote))
+        self.lotes += 1
+        self.textos += len(unicos)
+        try:
+            vectores = await self.cliente.embeber(unicos)
+        except Exception as e:
+            transitorio = isinstance(e, getattr(self.cliente, 'errores_transitorios', ()))
+            if len(unicos) > 1 and not transitorio:
+                # Un texto que la API rechaza no debe fallar a los demás: uno a uno
+                await asyncio.gather(*(
+                    self._enviar([(t, f) for t, f in lote if t == texto]) for texto in unicos
+                ))
+                return
+            for _, futuro in lote:
+                if not futuro.done():
+                    futuro.set_exception(e)
+            return
+        por_texto = dict(zip(unicos, vectores))
+        for texto, futuro in lote:
+            if not futuro.done():
+                futuro.set_result(por_texto[texto])
+
+    def estadisticas(self):
+        return {
+            'lotes': self.lotes,
+            'textos': self.textos,
+            'media_por_lote': round(self.textos / self.lotes, 2) if self.lotes else 0.0,
+        }
@@ -0,0 +1,56 @@
+from datetime import datetime
+
+# ===========================
+# FORMATEAR PROYECTO PARA MENSAJE
+# ===========================
+def ficha_estatica(p):
+    """
+    Parte fija de la ficha HTML del proyecto 'p': todo salvo los días
+    restantes hasta la deadline, que dependen del día en que se consulta.
+    """
+    texto = f"📌 <b>{p.titulo}</b>\n\n"
+    texto += f"🌍 <b>País:</b> {p.pais}    📌 <b>Ciudad:</b> {p.ciudad}\n"
+
+    if p.fecha_inicio:
+        inicio = p.fecha_inicio.strftime("%d/%m/%Y")
+    else:
+        inicio = "-"
+    if p.fecha_fin:
+        fin = p.fecha_fin.strftime("%d/%m/%Y")
+    else:
+        fin = "-"
+    texto += f"📅 <b>Inicio:</b> {inicio}    ⏳ <b>Fin:</b> {fin}\n\n"
+
+    if p.descripcion:
+        texto += f"📝 <b>Descripción:</b>\n{p.descripcion}\n\n"
+    if p.requisitos:
+        texto += f"✅ <b>Requisitos:</b>\n{p.requisitos}\n\n"
+    if p.gastos_cubiertos:
+        texto += f"💶 <b>Gastos cubiertos:</b>\n{p.gastos_cubiertos}\n\n"
+    if p.contacto:
+        texto += f"📧 <b>Contacto:</b> {p.contacto}\n"
+    if p.enlace:
+        texto += f"🔗 <b>Enlace:</b> {p.enlace}\n"
+
+    if p.deadline:
+        texto += f"\n⏰ <b>Deadline:</b> {p.deadline.strftime('%d/%m/%Y')}"
+    return texto
+
+def completar_ficha(base, p, mostrar_dias_deadline=False, hoy=None):
+    """Añade a la parte fija de la ficha los días restantes (si se piden) y el cierre."""
+    if not p.deadline:
+        return base
+    if mostrar_dias_deadline:
+        dias_rest = (p.deadline - (hoy or datetime.now().date())).days
+        if dias_rest >= 0:
+            return f"{base}  (<b>{dias_rest} días restantes</b>)\n"
+    return base + "\n"
+
+def ficha_proyecto(snap, p):
+    """
+    Ficha de detalle de 'p' con los días restantes. La parte fija se
+    renderiza una sola vez por proyecto y se guarda en la caché del
+    snapshot, que se descarta al recargar el catálogo.
+    """
+    base = snap.memo(('ficha', p.idx), lambda: ficha_estatica(p))
+    return completar_ficha(base, p, mostrar_dias_deadline=True)
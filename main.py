@@ -1,12 +1,35 @@
 from telethon import TelegramClient, events
 from telethon.tl.custom import Button
 from datetime import datetime, timedelta
-import csv
+import logging
+import asyncio
 import os
-import unicodedata
-import openai
-import numpy as np
-import re
+import signal
+import sys
+
+from catalogo import Catalogo, MESES_ES, filtrar_consulta
+from fichas import ficha_proyecto
+from embeddings import (
+    AgrupadorConsultas, AlmacenEmbeddings, CacheConsultas, MODELO_EMBEDDINGS,
+    construir_embeddings, crear_backend, directorio_embeddings, texto_embedding,
+)
+from busqueda import CANDIDATOS_LEXICOS, TOP_K_LEXICOS, MotorBusqueda, fusion_rrf, indice_lexico, terminos
+from sesiones import AlmacenSesiones, AlmacenSesionesSQLite
+from teclados import boton_mes, boton_pais, boton_proyecto, teclado_menu, teclado_paginado
+from navegacion import (
+    PREFIJO_DETALLE, PREFIJO_LISTA, TAM_PAGINA, Enrutador,
+    codificar_anio_mes, codificar_lista, decodificar_anio_mes, decodificar_id, token_lista,
+)
+
+# ===========================
+# SUBCOMANDOS
+# ===========================
+# `python main.py compilar [csv]` genera el catálogo compilado (.snap) que
+# el bot carga al arrancar en lugar del CSV (ver compilado.py).
+if __name__ == '__main__' and sys.argv[1:2] == ['compilar']:
+    logging.basicConfig(level=logging.INFO)
+    from compilado import main as compilar_catalogo
+    sys.exit(compilar_catalogo(sys.argv[2:]))
 
 # ===========================
 # CONFIGURACIÓN (config.py)
@@ -16,240 +39,188 @@ import re
 #   api_hash = "<TU_API_HASH_DE_TELEGRAM>"
 #   bot_token = "<TU_BOT_TOKEN_DE_TELEGRAM>"
 #   openai_api_key = "<TU_API_KEY_DE_OPENAI>"
+# y, opcionalmente, el backend de embeddings:
+#   backend_embeddings = "openai"   # o "local": sin red ni API key (ver embeddings.py)
+# y la compresión de la matriz de búsqueda (ver MotorBusqueda en busqueda.py):
+#   precision_embeddings = "int8"   # "float32" (por defecto), "float16" o "int8"
+#   dim_embeddings = 512            # truncar a las primeras N dimensiones
 
-from config import api_id, api_hash, bot_token, openai_api_key
+import config
+from config import api_id, api_hash, bot_token
+
+BACKEND_EMBEDDINGS = getattr(config, 'backend_embeddings', 'openai')
+PRECISION_EMBEDDINGS = getattr(config, 'precision_embeddings', 'float32')
+DIM_EMBEDDINGS = getattr(config, 'dim_embeddings', None)
 
 # ===========================
 # INICIALIZAR CLIENTES
 # ===========================
 client = TelegramClient('bot_session', api_id, api_hash).start(bot_token=bot_token)
-openai.api_key = openai_api_key
+if BACKEND_EMBEDDINGS == 'openai':
+    cliente_embeddings = crear_backend('openai', api_key=config.openai_api_key, modelo=MODELO_EMBEDDINGS)
+else:
+    cliente_embeddings = crear_backend(BACKEND_EMBEDDINGS)
+# Las consultas de varios usuarios que llegan casi a la vez viajan en una sola petición
+agrupador_consultas = AgrupadorConsultas(cliente_embeddings, max_lote=32, max_espera=0.01)
+logging.basicConfig(level=logging.INFO)
+log = logging.getLogger(__name__)
 
 # ===========================
-# NORMALIZACIÓN DE TEXTO
+# CATÁLOGO COMPARTIDO (se recarga solo si cambia el CSV)
 # ===========================
-def normalizar(texto: str) -> str:
-    """
-    Convierte texto a minúsculas y quita tildes/acentos.
-    Ejemplo: "Róterdam" -> "rotterdam"
-    """
-    nfkd = unicodedata.normalize("NFKD", texto)
-    return "".join(c for c in nfkd if not unicodedata.combining(c)).lower()
-
-# ===========================
-# CARGAR PROYECTOS DESDE CSV (fechas en ISO)
-# ===========================
-def cargar_todos_los_proyectos(archivo='erasmus_projects.csv'):
-    """
-    Lee un CSV con columnas:
-      pais,ciudad,titulo,descripcion,fecha_inicio,fecha_fin,
-      requisitos,gastos_cubiertos,contacto,enlace,deadline
-    (fechas en formato ISO YYYY-MM-DD).
-    Devuelve lista de diccionarios con:
-      - texto (str)
-      - fecha_inicio, fecha_fin, deadline como datetime.date o None
-    """
-    proyectos = []
-    if not os.path.exists(archivo):
-        return proyectos
-
-    with open(archivo, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        for fila in reader:
-            try:
-                fecha_ini = datetime.strptime(fila['fecha_inicio'], '%Y-%m-%d').date()
-            except Exception:
-                fecha_ini = None
-            try:
-                fecha_fin = datetime.strptime(fila['fecha_fin'], '%Y-%m-%d').date()
-            except Exception:
-                fecha_fin = None
-            try:
-                deadline = datetime.strptime(fila['deadline'], '%Y-%m-%d').date()
-            except Exception:
-                deadline = None
-
-            proyectos.append({
-                'pais': fila['pais'].strip(),
-                'ciudad': fila['ciudad'].strip(),
-                'titulo': fila['titulo'].strip(),
-                'descripcion': fila['descripcion'].strip(),
-                'fecha_inicio': fecha_ini,
-                'fecha_fin': fecha_fin,
-                'requisitos': fila.get('requisitos', '').strip(),
-                'gastos_cubiertos': fila.get('gastos_cubiertos', '').strip(),
-                'contacto': fila.get('contacto', '').strip(),
-                'enlace': fila.get('enlace', '').strip(),
-                'deadline': deadline
-            })
-    return proyectos
+catalogo = Catalogo('erasmus_projects.csv')
+# Cada backend guarda sus vectores aparte: cambiar de uno a otro no borra los del otro
+DIRECTORIO_EMBEDDINGS = directorio_embeddings('embeddings_cache', cliente_embeddings.modelo)
+almacen_embeddings = AlmacenEmbeddings(DIRECTORIO_EMBEDDINGS, cliente_embeddings.modelo)
+cache_consultas = CacheConsultas(
+    cliente_embeddings.modelo, ruta=os.path.join(DIRECTORIO_EMBEDDINGS, 'consultas.npz')
+)
+if hasattr(signal, 'SIGHUP'):
+    # `kill -HUP <pid>` fuerza la recarga del CSV sin reiniciar el bot
+    signal.signal(signal.SIGHUP, lambda *_: catalogo.solicitar_recarga())
 
 # ===========================
-# FORMATEAR PROYECTO PARA MENSAJE
+# FILTRADOS MANUALES
 # ===========================
-def formatear_proyecto(p, mostrar_dias_deadline=False):
-    """
-    Devuelve un texto HTML con emojis y negritas
-    para mostrar la información del proyecto 'p'.
-    """
-    texto = f"📌 <b>{p['titulo']}</b>\n\n"
-    texto += f"🌍 <b>País:</b> {p['pais']}    📌 <b>Ciudad:</b> {p['ciudad']}\n"
-
-    if p['fecha_inicio']:
-        inicio = p['fecha_inicio'].strftime("%d/%m/%Y")
-    else:
-        inicio = "-"
-    if p['fecha_fin']:
-        fin = p['fecha_fin'].strftime("%d/%m/%Y")
-    else:
-        fin = "-"
-    texto += f"📅 <b>Inicio:</b> {inicio}    ⏳ <b>Fin:</b> {fin}\n\n"
-
-    if p['descripcion']:
-        texto += f"📝 <b>Descripción:</b>\n{p['descripcion']}\n\n"
-    if p['requisitos']:
-        texto += f"✅ <b>Requisitos:</b>\n{p['requisitos']}\n\n"
-    if p['gastos_cubiertos']:
-        texto += f"💶 <b>Gastos cubiertos:</b>\n{p['gastos_cubiertos']}\n\n"
-    if p['contacto']:
-        texto += f"📧 <b>Contacto:</b> {p['contacto']}\n"
-    if p['enlace']:
-        texto += f"🔗 <b>Enlace:</b> {p['enlace']}\n"
-
-    if p['deadline']:
-        texto += f"\n⏰ <b>Deadline:</b> {p['deadline'].strftime('%d/%m/%Y')}"
-        if mostrar_dias_deadline:
-            dias_rest = (p['deadline'] - datetime.now().date()).days
-            if dias_rest >= 0:
-                texto += f"  (<b>{dias_rest} días restantes</b>)"
-        texto += "\n"
-
-    return texto
-
+# Los menús (país, mes, deadlines) leen directamente los índices del
+# Snapshot (snap.indices_pais, snap.indices_anio_mes, snap.indices_deadline,
+# ...); los filtros de un mensaje libre, con catalogo.filtrar_consulta.
 # ===========================
-# FILTRADOS MANUALES
+# BÚSQUEDA SEMÁNTICA CON EMBEDDINGS
 # ===========================
-MESES_ES = [
-    "enero", "febrero", "marzo", "abril", "mayo", "junio",
-    "julio", "agosto", "septiembre", "octubre", "noviembre", "diciembre"
-]
-MESES_NORMAL = [normalizar(m) for m in MESES_ES]
-
-def obtener_lista_paises(proyectos):
-    """Retorna lista ordenada de países únicos en los proyectos."""
-    return sorted({p['pais'] for p in proyectos})
-
-def obtener_lista_ciudades(proyectos):
-    """Retorna lista ordenada de ciudades únicas en los proyectos."""
-    return sorted({p['ciudad'] for p in proyectos})
-
-def filtrar_por_pais(proyectos, pais):
+async def calcular_embeds_proyectos(snap, podar=True):
     """
-    Filtra proyectos donde p['pais'] == pais.
-    Ordena por fecha_inicio ascendente.
+    Devuelve una matriz con un embedding por proyecto del snapshot,
+    usando 'Título + Descripción' como texto fuente.
+    Si el catálogo compilado ya trae la matriz (mismo modelo), se usa tal
+    cual. Si no, los vectores ya calculados se leen del almacén en disco;
+    solo se piden a OpenAI los proyectos nuevos o modificados,
+    en lotes paralelos que se pueden reanudar si se corta.
+    Con podar=False no se borran del almacén los vectores de otros proyectos.
     """
-    r = [p for p in proyectos if p['pais'] == pais]
-    r.sort(key=lambda x: x['fecha_inicio'] or datetime.max.date())
-    return r
-
-def filtrar_por_ciudad(proyectos, ciudad):
+    if snap.embeddings is not None and snap.modelo_embeddings == cliente_embeddings.modelo:
+        return snap.embeddings
+    proyectos = snap.proyectos
+    textos = [texto_embedding(p) for p in proyectos]
+    await construir_embeddings(textos, cliente_embeddings, almacen_embeddings, paralelo=4,
+                               podar=podar)
+    # Con matriz compacta los vectores completos solo se leen para recalcular
+    # los mejores candidatos, así que pueden quedarse en el mmap
+    return almacen_embeddings.matriz(textos, mmap=PRECISION_EMBEDDINGS != 'float32' or DIM_EMBEDDINGS is not None)
+
+async def embedding_consulta(query):
     """
-    Filtra proyectos donde p['ciudad'] == ciudad.
-    Ordena por fecha_inicio ascendente.
+    Embedding de una consulta, reutilizando la caché si ya se hizo
+    la misma pregunta (ignorando mayúsculas, tildes y espacios).
+    Los fallos de caché se agrupan en micro-lotes con otras consultas.
     """
-    r = [p for p in proyectos if p['ciudad'] == ciudad]
-    r.sort(key=lambda x: x['fecha_inicio'] or datetime.max.date())
-    return r
+    embed_q = cache_consultas.obtener(query)
+    if embed_q is None:
+        embed_q = await agrupador_consultas.embeber_uno(query)
+        cache_consultas.poner(query, embed_q)
+    return embed_q
 
-def filtrar_por_mes(proyectos, mes_norm):
+async def buscar_proyectos_semantico(query, motor, top_k=5, filas=None, limitar=True):
     """
-    Filtra proyectos cuyo mes de 'fecha_inicio' coincide con mes_norm (sin tildes).
-    Ordena por fecha_inicio.
-    """
-    try:
-        idx_mes = MESES_NORMAL.index(mes_norm) + 1
-    except ValueError:
-        return []
-    r = []
-    for p in proyectos:
-        if p['fecha_inicio'] and p['fecha_inicio'].month == idx_mes:
-            r.append(p)
-    r.sort(key=lambda x: x['fecha_inicio'])
-    return r
-
-def filtrar_por_rango(proyectos, inicio, fin):
-    """
-    Filtra proyectos cuya 'fecha_inicio' está entre inicio y fin inclusive.
-    Ordena por fecha_inicio.
-    """
-    r = []
-    for p in proyectos:
-        if p['fecha_inicio'] and inicio <= p['fecha_inicio'] <= fin:
-            r.append(p)
-    r.sort(key=lambda x: x['fecha_inicio'])
-    return r
-
-def filtrar_deadline_proxima(proyectos, dias=14):
-    """
-    Retorna proyectos cuya 'deadline' esté entre hoy y hoy+dias.
-    Ordena por deadline ascendente.
+    Dada una consulta en lenguaje natural, calcula su embedding y
+    obtiene las similitudes coseno con los proyectos del 'motor'
+    (solo con 'filas' si se indican, p.ej. tras un filtro manual).
+    Devuelve los índices de catálogo de los proyectos que superan 0.7
+    (como mucho 'top_k' si limitar=True) o, si ninguno lo supera,
+    los 'top_k' más similares.
     """
-    hoy = datetime.now().date()
-    r = []
-    for p in proyectos:
-        if p['deadline']:
-            diff = (p['deadline'] - hoy).days
-            if 0 <= diff <= dias:
-                r.append(p)
-    r.sort(key=lambda x: x['deadline'])
-    return r
+    embed_q = await embedding_consulta(query)
+    return motor.buscar(embed_q, top_k=top_k, filas=filas, limitar=limitar)
 
 # ===========================
-# BÚSQUEDA SEMÁNTICA CON EMBEDDINGS
+# BÚSQUEDA HÍBRIDA (BM25 local + embeddings)
 # ===========================
-def calcular_embeds_proyectos(proyectos):
+# En el paso 5 entran en la fusión CANDIDATOS_LEXICOS resultados BM25 y al
+# instante se muestran los TOP_K_LEXICOS mejores (ver busqueda.py).
+# Si es True, los candidatos léxicos se reordenan después con los embeddings
+# (una llamada a la API, cacheada) fusionando ambas listas por RRF.
+RERANKING_VECTORIAL = True
+_indice_lexico_lock = asyncio.Lock()
+
+async def obtener_indice_lexico(snap):
     """
-    Calcula y devuelve una lista de embeddings para cada proyecto,
-    usando 'Título + Descripción' como texto fuente.
+    Índice BM25 del snapshot (ver busqueda.indice_lexico). La primera vez
+    tras cada recarga se construye en un hilo, sin bloquear el bucle de eventos.
     """
-    textos = []
-    for p in proyectos:
-        txt = f"{p['titulo']}. {p['descripcion']}"
-        textos.append(txt)
-
-    resp = openai.embeddings.create(model="text-embedding-3-small", input=textos)
-    embeddings = [np.array(d.embedding) for d in resp.data]
-    return embeddings
+    if 'bm25' not in snap.cache:
+        async with _indice_lexico_lock:
+            await asyncio.to_thread(indice_lexico, snap)
+    return indice_lexico(snap)
 
-def buscar_proyectos_semantico(query, proyectos, embeddings_proyectos, top_k=5):
+# ===========================
+# CONTEXTO DE NAVEGACIÓN POR USUARIO
+# ===========================
+# Los botones de proyecto llevan su ID en el propio callback (ver
+# navegacion.py), así que no necesitan contexto. La sesión de cada user_id
+# (modo + IDs estables del último listado, con caducidad y tope de memoria)
+# solo se usa para paginar resultados de búsquedas libres y para los
+# botones "proy_<modo>_<i>" antiguos.
+# Además, cada snapshot del catálogo guarda en snap.motor su motor de
+# búsqueda con los embeddings de sus proyectos (se crea uno nuevo si el
+# CSV cambia).
+# Con RUTA_SESIONES = None las sesiones viven solo en memoria y se pierden al
+# reiniciar; con una ruta se guardan en SQLite y los botones siguen funcionando.
+RUTA_SESIONES = 'sesiones.db'
+if RUTA_SESIONES:
+    sesiones = AlmacenSesionesSQLite(RUTA_SESIONES, max_sesiones=10_000, ttl=6 * 3600, max_bytes=16 * 1024 * 1024)
+else:
+    sesiones = AlmacenSesiones(max_sesiones=10_000, ttl=6 * 3600, max_bytes=16 * 1024 * 1024)
+client._motor_lock = asyncio.Lock()
+client._motor = None  # motor del snapshot más reciente (base del índice ANN del siguiente)
+client._motor_version = 0  # versión más reciente con motor construido
+
+async def obtener_motor(snap):
     """
-    Dada una consulta en lenguaje natural, calcula su embedding y
-    obtiene las distancias coseno con los embeddings de proyectos.
-    Devuelve los índices de los 'top_k' proyectos más similares.
+    Devuelve el MotorBusqueda alineado con el snapshot 'snap',
+    construyéndolo la primera vez que se pide. Un handler que empezó con
+    un snapshot anterior a una recarga sigue usando el motor de ese
+    snapshot: no se reconstruye un motor por volver a una versión vieja.
+    Solo el snapshot más reciente poda el almacén de embeddings; uno viejo
+    no debe borrar los vectores que ya necesita el catálogo nuevo.
+    Mientras se construye, los handlers cuyo snapshot ya tiene motor no esperan.
     """
-    resp = openai.embeddings.create(model="text-embedding-3-small", input=[query])
-    embed_query = np.array(resp.data[0].embedding)
-
-    sims = []
-    for idx, emb_p in enumerate(embeddings_proyectos):
-        cos = np.dot(embed_query, emb_p) / (np.linalg.norm(embed_query) * np.linalg.norm(emb_p))
-        sims.append((cos, idx))
-
-    sims.sort(reverse=True, key=lambda x: x[0])
-    resultados = [idx for cos, idx in sims if cos >= 0.7]
-    if not resultados:
-        resultados = [idx for _, idx in sims[:top_k]]
-    else:
-        resultados = resultados[:top_k]
-    return resultados
+    if snap.motor is None:
+        async with client._motor_lock:
+            if snap.motor is None:
+                podar = snap.version >= client._motor_version
+                embeds = await calcular_embeds_proyectos(snap, podar=podar)
+                # Con el motor anterior, el índice ANN se actualiza en lugar de
+                # reentrenarse. El k-means va en un hilo para no parar el bucle.
+                snap.motor = await asyncio.to_thread(
+                    MotorBusqueda, embeds, ids=[p.id for p in snap.proyectos], previo=client._motor,
+                    precision=PRECISION_EMBEDDINGS, dim=DIM_EMBEDDINGS
+                )
+                if podar:
+                    client._motor, client._motor_version = snap.motor, snap.version
+    return snap.motor
 
 # ===========================
-# CONTEXTO DE NAVEGACIÓN POR USUARIO
+# TECLADOS PAGINADOS
 # ===========================
-# Guardamos para cada user_id un dict con {'modo': <modo>, 'lista': <lista_filtrada>}.
-# Además, almacenamos los embeddings de proyectos en memoria.
-client._contexto = getattr(client, '_contexto', {})
-client._embeddings = None  # Aquí cargaremos embeddings al arrancar
+# Los teclados que solo dependen del catálogo están en teclados.py; aquí,
+# los que guardan el listado en la sesión del usuario.
+def teclado_resultados(user_id, modo, resultados):
+    """
+    Primera página de un listado de búsqueda libre. Si ocupa más de una
+    página, sus IDs se guardan en la sesión del usuario para poder pasar
+    de página (la consulta original no cabe en el callback_data) y los
+    botones de página llevan el token de esa lista.
+    """
+    token = ''
+    if len(resultados) > TAM_PAGINA:
+        ids = [p.id for p in resultados]
+        sesiones.guardar(user_id, modo, ids)
+        token = token_lista(ids)
+    return teclado_paginado(
+        resultados, 0,
+        lambda n: codificar_lista(modo, '', n, token),
+        lambda p: boton_proyecto(modo, p)
+    )
 
 # ===========================
 # INICIALIZAR EMBEDDINGS (al arrancar el bot)
@@ -261,11 +232,9 @@ async def initialize_and_start(event):
     si aún no se han calculado, para usarlos luego en búsquedas semánticas.
     """
     user_id = str(event.sender_id)
-    if client._embeddings is None:
-        proyectos = cargar_todos_los_proyectos()
-        client._embeddings = calcular_embeds_proyectos(proyectos)
+    await obtener_motor(catalogo.actual())
 
-    client._contexto[user_id] = None
+    sesiones.borrar(user_id)
     botones = [
         [Button.inline('🌍 Buscar por país', 'menu_paises')],
         [Button.inline('📅 Buscar por mes', 'menu_meses')],
@@ -288,60 +257,19 @@ async def texto_libre(event):
     if event.out:
         return
     texto_original = event.text.strip()
-    if texto_original.startswith('/'):
+    # Fotos, stickers... llegan sin texto: no hay nada que buscar
+    if not texto_original or texto_original.startswith('/'):
         return
 
     user_id = str(event.sender_id)
-    proyectos = cargar_todos_los_proyectos()
-    norm = normalizar(texto_original)
-
-    # Preparamos mapas de países y ciudades normalizadas → reales
-    lista_paises = obtener_lista_paises(proyectos)
-    mapa_paises_norm = {normalizar(p): p for p in lista_paises}
-    lista_ciudades = obtener_lista_ciudades(proyectos)
-    mapa_ciudades_norm = {normalizar(c): c for c in lista_ciudades}
-
-    # 1) Detectar país o ciudad
-    pais_detectado = None
-    for p_norm, p_real in mapa_paises_norm.items():
-        if p_norm in norm.split():
-            pais_detectado = p_real
-            break
-
-    ciudad_detectada = None
-    for c_norm, c_real in mapa_ciudades_norm.items():
-        if c_norm in norm.split():
-            ciudad_detectada = c_real
-            break
-
-    # 2) Detectar mes en español
-    mes_detectado = None
-    for m_norm, m_real in zip(MESES_NORMAL, MESES_ES):
-        if m_norm in norm:
-            mes_detectado = m_real
-            break
-
-    # 3) Detectar rango de fechas YYYY-MM-DD (si hay al menos 2 coincidencias)
-    fechas = re.findall(r'(\d{4}-\d{2}-\d{2})', texto_original)
-    rango_inicio = rango_fin = None
-    if len(fechas) >= 2:
-        try:
-            rango_inicio = datetime.strptime(fechas[0], '%Y-%m-%d').date()
-            rango_fin = datetime.strptime(fechas[1], '%Y-%m-%d').date()
-        except Exception:
-            rango_inicio = rango_fin = None
-
-    # 4) Extraer palabras clave restantes (todo lo que no sea país/ciudad/mes/fechas)
-    texto_sin_pm = norm
-    if pais_detectado:
-        texto_sin_pm = texto_sin_pm.replace(normalizar(pais_detectado), "")
-    if ciudad_detectada:
-        texto_sin_pm = texto_sin_pm.replace(normalizar(ciudad_detectada), "")
-    if mes_detectado:
-        texto_sin_pm = texto_sin_pm.replace(normalizar(mes_detectado), "")
-    for f in fechas:
-        texto_sin_pm = texto_sin_pm.replace(f, "")
-    palabras = [w for w in re.findall(r'\w+', texto_sin_pm) if len(w) >= 3]
+    snap = catalogo.actual()
+    proyectos = snap.proyectos
+
+    # Una sola pasada sobre el mensaje normalizado: países, ciudades
+    # (también compuestas, p.ej. "Nueva York"), meses, fechas ISO y
+    # palabras clave restantes. El extractor se construye por snapshot.
+    entidades = snap.extractor.extraer(texto_original)
+    palabras = entidades['palabras']
 
     # ======================================================
     # ORDEN DE FILTRADO:
@@ -349,292 +277,66 @@ async def texto_libre(event):
     # 2) Fechas solamente
     # 3) País/Ciudad + Mes
     # 4) País/Ciudad solo o Mes solo
+    #    (pasos 1-4 en catalogo.filtrar_consulta, que también usa benchmark.py)
     # 5) Embeddings (semántico) dentro del subconjunto manual si hay palabras clave,
-    #    o en toda la base si no hay filtrado manual.
+    #    o en toda la base si no hay filtrado manual (primero BM25 local y
+    #    después reordenación con embeddings).
     # ======================================================
-
-    # ---------------------------------
-    # 1) Fechas + País/Ciudad
-    # ---------------------------------
-    if rango_inicio and rango_fin and (pais_detectado or ciudad_detectada):
-        if pais_detectado:
-            base = filtrar_por_pais(proyectos, pais_detectado)
-        else:
-            base = filtrar_por_ciudad(proyectos, ciudad_detectada)
-
-        # Filtrar por rango sobre la base
-        filtrados = [p for p in base if p['fecha_inicio'] and rango_inicio <= p['fecha_inicio'] <= rango_fin]
-        filtrados.sort(key=lambda x: x['fecha_inicio'] or datetime.max.date())
-
-        # Si existen palabras clave, aplicar búsqueda semántica sobre este subconjunto
-        if palabras and filtrados:
-            textos_sub = [f"{p['titulo']}. {p['descripcion']}" for p in filtrados]
-            resp = openai.embeddings.create(model="text-embedding-3-small", input=textos_sub)
-            embeds_sub = [np.array(d.embedding) for d in resp.data]
-
-            resp_q = openai.embeddings.create(model="text-embedding-3-small", input=[" ".join(palabras)])
-            embed_q = np.array(resp_q.data[0].embedding)
-
-            sims = []
-            for idx, emb_p in enumerate(embeds_sub):
-                cos = np.dot(embed_q, emb_p) / (np.linalg.norm(embed_q) * np.linalg.norm(emb_p))
-                sims.append((cos, idx))
-            sims.sort(reverse=True, key=lambda x: x[0])
-            indices_sem = [idx for cos, idx in sims if cos >= 0.7]
-            if not indices_sem:
-                indices_sem = [idx for _, idx in sims[:5]]
-
-            resultados = [filtrados[i] for i in indices_sem]
-            client._contexto[user_id] = {'modo': 'rango_sem', 'lista': resultados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_rango_sem_{i}')]
-                for i, p in enumerate(resultados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(
-                f"Resultados semánticos en {pais_detectado or ciudad_detectada} entre {fechas[0]} y {fechas[1]}:",
-                buttons=botones
+    filtro = filtrar_consulta(snap, entidades)
+    if filtro:
+        modo, filtrados, ambito = filtro
+        # Si hay palabras clave, búsqueda semántica sobre el subconjunto
+        if palabras:
+            # Reutilizamos los vectores del catálogo (sin llamar a la API)
+            indices_sem = await buscar_proyectos_semantico(
+                " ".join(palabras), await obtener_motor(snap),
+                filas=list(filtrados), limitar=False
             )
+            resultados = [proyectos[i] for i in indices_sem]
+            botones = teclado_resultados(user_id, f'{modo}_sem', resultados)
+            await event.respond(f"Resultados semánticos {ambito}:", buttons=botones)
             return
 
-        # Si no hay palabras clave, devolvemos la lista completa
-        if filtrados:
-            client._contexto[user_id] = {'modo': 'rango', 'lista': filtrados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_rango_{i}')]
-                for i, p in enumerate(filtrados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(
-                f"Proyectos en {pais_detectado or ciudad_detectada} entre {fechas[0]} y {fechas[1]}:",
-                buttons=botones
-            )
-            return
-        # Si no hay filtrados, continuamos al siguiente paso
+        # Si no hay palabras clave, devolvemos la lista manual
+        botones = teclado_resultados(user_id, modo, snap.proyectos_de(filtrados))
+        await event.respond(f"Proyectos {ambito}:", buttons=botones)
+        return
 
     # ---------------------------------
-    # 2) Fechas solamente
+    # 5) FALLBACK: Búsqueda en TODO el dataset
     # ---------------------------------
-    if rango_inicio and rango_fin:
-        filtrados = filtrar_por_rango(proyectos, rango_inicio, rango_fin)
-
-        # Si existen palabras clave, aplicar semántico sobre este subconjunto
-        if palabras and filtrados:
-            textos_sub = [f"{p['titulo']}. {p['descripcion']}" for p in filtrados]
-            resp = openai.embeddings.create(model="text-embedding-3-small", input=textos_sub)
-            embeds_sub = [np.array(d.embedding) for d in resp.data]
-
-            resp_q = openai.embeddings.create(model="text-embedding-3-small", input=[" ".join(palabras)])
-            embed_q = np.array(resp_q.data[0].embedding)
-
-            sims = []
-            for idx, emb_p in enumerate(embeds_sub):
-                cos = np.dot(embed_q, emb_p) / (np.linalg.norm(embed_q) * np.linalg.norm(emb_p))
-                sims.append((cos, idx))
-            sims.sort(reverse=True, key=lambda x: x[0])
-            indices_sem = [idx for cos, idx in sims if cos >= 0.7]
-            if not indices_sem:
-                indices_sem = [idx for _, idx in sims[:5]]
-
-            resultados = [filtrados[i] for i in indices_sem]
-            client._contexto[user_id] = {'modo': 'rango_sem', 'lista': resultados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_rango_sem_{i}')]
-                for i, p in enumerate(resultados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(
-                f"Resultados semánticos entre {fechas[0]} y {fechas[1]}:",
-                buttons=botones
-            )
-            return
-
-        if filtrados:
-            client._contexto[user_id] = {'modo': 'rango', 'lista': filtrados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_rango_{i}')]
-                for i, p in enumerate(filtrados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(f"Proyectos entre {fechas[0]} y {fechas[1]}:", buttons=botones)
+    # Primero BM25 local, sin red: si hay coincidencias se muestran ya las
+    # mejores y, si RERANKING_VECTORIAL, se reordenan con embeddings
+    # fusionando por RRF. La lista fusionada se corta como la semántica:
+    # todos los que superan 0.7 o, si ninguno lo supera, los 5 mejores.
+    indice = await obtener_indice_lexico(snap)
+    lexicos = indice.buscar(terminos(texto_original), top_k=CANDIDATOS_LEXICOS)
+    if lexicos:
+        mostrados = lexicos[:TOP_K_LEXICOS]
+        resultados = [proyectos[i] for i in mostrados]
+        msg_resultados = await event.respond(
+            f"Hemos encontrado {len(resultados)} proyecto(s) con esas palabras:",
+            buttons=teclado_resultados(user_id, 'nlp', resultados)
+        )
+        if not RERANKING_VECTORIAL:
             return
-        # Si no hay en ese rango, seguimos
-
-    # ---------------------------------
-    # 3) País/Ciudad + Mes
-    # ---------------------------------
-    if (pais_detectado or ciudad_detectada) and mes_detectado:
-        if pais_detectado:
-            base = filtrar_por_pais(proyectos, pais_detectado)
-            target = pais_detectado
-        else:
-            base = filtrar_por_ciudad(proyectos, ciudad_detectada)
-            target = ciudad_detectada
-
-        idx_mes = MESES_ES.index(mes_detectado) + 1
-        filtrados = [p for p in base if p['fecha_inicio'] and p['fecha_inicio'].month == idx_mes]
-        filtrados.sort(key=lambda x: x['fecha_inicio'] or datetime.max.date())
-
-        # Si hay palabras clave, búsqueda semántica sobre filtrados
-        if palabras and filtrados:
-            textos_sub = [f"{p['titulo']}. {p['descripcion']}" for p in filtrados]
-            resp = openai.embeddings.create(model="text-embedding-3-small", input=textos_sub)
-            embeds_sub = [np.array(d.embedding) for d in resp.data]
-
-            resp_q = openai.embeddings.create(model="text-embedding-3-small", input=[" ".join(palabras)])
-            embed_q = np.array(resp_q.data[0].embedding)
-
-            sims = []
-            for idx, emb_p in enumerate(embeds_sub):
-                cos = np.dot(embed_q, emb_p) / (np.linalg.norm(embed_q) * np.linalg.norm(emb_p))
-                sims.append((cos, idx))
-            sims.sort(reverse=True, key=lambda x: x[0])
-            indices_sem = [idx for cos, idx in sims if cos >= 0.7]
-            if not indices_sem:
-                indices_sem = [idx for _, idx in sims[:5]]
-
-            resultados = [filtrados[i] for i in indices_sem]
-            client._contexto[user_id] = {'modo': 'pais_mes_sem', 'lista': resultados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_pais_mes_sem_{i}')]
-                for i, p in enumerate(resultados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(
-                f"Resultados semánticos en {target} durante {mes_detectado}:",
-                buttons=botones
+        try:
+            vectoriales = await buscar_proyectos_semantico(texto_original, await obtener_motor(snap), limitar=False)
+        except Exception:
+            # Sin embeddings se queda la lista léxica que ya se mostró
+            log.exception("No se pudo reordenar con embeddings: %r", texto_original)
+            return
+        fusion = fusion_rrf(lexicos, vectoriales)[:len(vectoriales)]
+        if fusion != mostrados:
+            resultados = [proyectos[i] for i in fusion]
+            await msg_resultados.edit(
+                f"Hemos encontrado {len(resultados)} proyecto(s) relevantes en toda la base:",
+                buttons=teclado_resultados(user_id, 'nlp', resultados)
             )
-            return
-
-        if filtrados:
-            client._contexto[user_id] = {'modo': 'pais_mes', 'lista': filtrados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_pais_mes_{i}')]
-                for i, p in enumerate(filtrados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(f"Proyectos en {target} durante {mes_detectado}:", buttons=botones)
-            return
-        # Si no hay coincidencias, seguimos
-
-    # ---------------------------------
-    # 4) País/Ciudad solo o Mes solo
-    # ---------------------------------
-    # 4a) País o Ciudad solo
-    if pais_detectado or ciudad_detectada:
-        if pais_detectado:
-            filtrados = filtrar_por_pais(proyectos, pais_detectado)
-            modo = 'pais'
-            target = pais_detectado
-        else:
-            filtrados = filtrar_por_ciudad(proyectos, ciudad_detectada)
-            modo = 'ciudad'
-            target = ciudad_detectada
-
-        # Si hay palabras clave, semántico sobre este subconjunto
-        if palabras and filtrados:
-            textos_sub = [f"{p['titulo']}. {p['descripcion']}" for p in filtrados]
-            resp = openai.embeddings.create(model="text-embedding-3-small", input=textos_sub)
-            embeds_sub = [np.array(d.embedding) for d in resp.data]
-
-            resp_q = openai.embeddings.create(model="text-embedding-3-small", input=[" ".join(palabras)])
-            embed_q = np.array(resp_q.data[0].embedding)
-
-            sims = []
-            for idx, emb_p in enumerate(embeds_sub):
-                cos = np.dot(embed_q, emb_p) / (np.linalg.norm(embed_q) * np.linalg.norm(emb_p))
-                sims.append((cos, idx))
-            sims.sort(reverse=True, key=lambda x: x[0])
-            indices_sem = [idx for cos, idx in sims if cos >= 0.7]
-            if not indices_sem:
-                indices_sem = [idx for _, idx in sims[:5]]
-
-            resultados = [filtrados[i] for i in indices_sem]
-            client._contexto[user_id] = {'modo': f'{modo}_sem', 'lista': resultados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_{modo}_sem_{i}')]
-                for i, p in enumerate(resultados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(f"Resultados semánticos en {target}:", buttons=botones)
-            return
-
-        # Si no hay palabras clave, devolvemos la lista manual
-        if filtrados:
-            client._contexto[user_id] = {'modo': modo, 'lista': filtrados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_{modo}_{i}')]
-                for i, p in enumerate(filtrados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(f"Proyectos en {target}:", buttons=botones)
-            return
-        # Si no hay proyectos en ese país/ciudad, seguimos
-
-    # 4b) Mes solo
-    if mes_detectado:
-        idx_mes = MESES_ES.index(mes_detectado) + 1
-        filtrados = [p for p in proyectos if p['fecha_inicio'] and p['fecha_inicio'].month == idx_mes]
-        filtrados.sort(key=lambda x: x['fecha_inicio'] or datetime.max.date())
-
-        if palabras and filtrados:
-            textos_sub = [f"{p['titulo']}. {p['descripcion']}" for p in filtrados]
-            resp = openai.embeddings.create(model="text-embedding-3-small", input=textos_sub)
-            embeds_sub = [np.array(d.embedding) for d in resp.data]
-
-            resp_q = openai.embeddings.create(model="text-embedding-3-small", input=[" ".join(palabras)])
-            embed_q = np.array(resp_q.data[0].embedding)
-
-            sims = []
-            for idx, emb_p in enumerate(embeds_sub):
-                cos = np.dot(embed_q, emb_p) / (np.linalg.norm(embed_q) * np.linalg.norm(emb_p))
-                sims.append((cos, idx))
-            sims.sort(reverse=True, key=lambda x: x[0])
-            indices_sem = [idx for cos, idx in sims if cos >= 0.7]
-            if not indices_sem:
-                indices_sem = [idx for _, idx in sims[:5]]
-
-            resultados = [filtrados[i] for i in indices_sem]
-            client._contexto[user_id] = {'modo': 'mes_sem', 'lista': resultados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_mes_sem_{i}')]
-                for i, p in enumerate(resultados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(f"Resultados semánticos en {mes_detectado}:", buttons=botones)
-            return
-
-        if filtrados:
-            client._contexto[user_id] = {'modo': 'mes', 'lista': filtrados}
-            botones = [
-                [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_mes_{i}')]
-                for i, p in enumerate(filtrados)
-            ]
-            botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-            await event.respond(f"Proyectos en {mes_detectado}:", buttons=botones)
-            return
-        # Si no hay proyectos en ese mes, seguimos
+        return
 
-    # ---------------------------------
-    # 5) FALLBACK: Búsqueda semántica en TODO el dataset
-    # ---------------------------------
     msg_buscando = await event.respond("🔎 Buscando proyectos semánticamente con embeddings en toda la base...")
-    embeddings = client._embeddings or []
-    if not embeddings:
-        embeddings = calcular_embeds_proyectos(proyectos)
-        client._embeddings = embeddings
-
-    resp_q = openai.embeddings.create(model="text-embedding-3-small", input=[texto_original])
-    embed_q = np.array(resp_q.data[0].embedding)
-
-    sims = []
-    for idx, emb_p in enumerate(embeddings):
-        cos = np.dot(embed_q, emb_p) / (np.linalg.norm(embed_q) * np.linalg.norm(emb_p))
-        sims.append((cos, idx))
-    sims.sort(reverse=True, key=lambda x: x[0])
-    indices_sem = [idx for cos, idx in sims if cos >= 0.7]
-    if not indices_sem:
-        indices_sem = [idx for _, idx in sims[:5]]
+    indices_sem = await buscar_proyectos_semantico(texto_original, await obtener_motor(snap), limitar=False)
 
     resultados = [proyectos[i] for i in indices_sem]
     if not resultados:
@@ -644,374 +346,242 @@ async def texto_libre(event):
         )
         return
 
-    client._contexto[user_id] = {'modo': 'nlp', 'lista': resultados}
-    botones = [
-        [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_nlp_{i}')]
-        for i, p in enumerate(resultados)
-    ]
-    botones.append([Button.inline('🏠 Volver al inicio', 'start')])
+    botones = teclado_resultados(user_id, 'nlp', resultados)
     await msg_buscando.edit(f"Hemos encontrado {len(resultados)} proyecto(s) semánticamente similares en toda la base:", buttons=botones)
 
 # ===========================
 # CALLBACKS PARA BOTONES
 # ===========================
+# Destino del botón "Volver atrás" en el detalle según la vista de origen
+VOLVER_POR_MODO = {
+    'rango': 'menu_rango', 'rango_sem': 'menu_rango',
+    'pais_mes': 'start', 'pais_mes_sem': 'start',
+    'pais': 'menu_paises', 'pais_sem': 'menu_paises',
+    'ciudad': 'menu_ciudades', 'ciudad_sem': 'menu_ciudades',
+    'mes': 'menu_meses', 'mes_sem': 'menu_meses',
+    'deadline': None, 'nlp': None,
+}
+
+enrutador = Enrutador()
+
 @client.on(events.CallbackQuery)
 async def callback_query_handler(event):
-    data = event.data.decode()
-    user_id = str(event.sender_id)
-    proyectos = cargar_todos_los_proyectos()
-    ctx = client._contexto.get(user_id)
-
-    # --- Volver al menú principal ---
-    if data == 'start':
-        client._contexto[user_id] = None
-        botones = [
-            [Button.inline('🌍 Buscar por país', 'menu_paises')],
-            [Button.inline('📅 Buscar por mes', 'menu_meses')],
-            [Button.inline('📆 Buscar entre fechas', 'menu_rango')],
-            [Button.inline('⏳ Deadline próxima', 'menu_deadline')]
-        ]
-        await event.edit('¿Cómo quieres buscar proyectos Erasmus?', buttons=botones)
-        return
-
-    # --- Menú “Buscar por país” ---
-    if data == 'menu_paises':
-        lista_paises = obtener_lista_paises(proyectos)
-        botones = [[Button.inline(p, f'pais_{p}')] for p in lista_paises]
-        botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-        await event.edit('Elige un país para ver proyectos:', buttons=botones)
-        return
-
-    # --- Selección de un país ---
-    if data.startswith('pais_'):
-        pais = data.split('pais_', 1)[1]
-        proyectos_pais = filtrar_por_pais(proyectos, pais)
-        client._contexto[user_id] = {'modo': 'pais', 'lista': proyectos_pais}
-        if not proyectos_pais:
-            await event.edit(f'No hay proyectos Erasmus registrados para {pais}.')
-            return
-        botones = [
-            [Button.inline(f"{p['titulo']} ({p['ciudad']})", f'proy_pais_{i}')]
-            for i, p in enumerate(proyectos_pais)
-        ]
-        botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-        await event.edit(f'Proyectos en {pais}:', buttons=botones)
-        return
-
-    # --- Menú “Buscar por mes” ---
-    if data == 'menu_meses':
-        meses_set = set()
-        for p in proyectos:
-            if p['fecha_inicio']:
-                meses_set.add(p['fecha_inicio'].strftime("%B %Y"))
-        lista_meses = sorted(
-            meses_set,
-            key=lambda x: (
-                int(x.split()[1]),
-                datetime.strptime(x.split()[0], "%B").month
-            )
-        )
-        botones = [[Button.inline(m, f'mes_{m}')] for m in lista_meses]
-        botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-        await event.edit('Elige un mes (p.ej. "July 2025") para ver proyectos:', buttons=botones)
+    await enrutador.despachar(event, event.data.decode(), catalogo.actual())
+
+# Teclado del detalle según la vista de origen (no depende del proyecto)
+TECLADOS_DETALLE = {
+    modo: ([[Button.inline('🔙 Volver atrás', volver)]] if volver else [])
+          + [[Button.inline('🏠 Volver al inicio', 'start')]]
+    for modo, volver in VOLVER_POR_MODO.items()
+}
+
+async def mostrar_detalle(event, snap, proyecto, modo):
+    """Muestra la ficha de 'proyecto' con los botones de vuelta de su vista."""
+    texto = ficha_proyecto(snap, proyecto)
+    botones = TECLADOS_DETALLE.get(modo) or TECLADOS_DETALLE['nlp']
+    await event.edit(texto, buttons=botones, parse_mode='html')
+
+# --- Volver al menú principal ---
+@enrutador.ruta('start')
+async def cb_start(event, snap, modo):
+    sesiones.borrar(str(event.sender_id))
+    botones = [
+        [Button.inline('🌍 Buscar por país', 'menu_paises')],
+        [Button.inline('📅 Buscar por mes', 'menu_meses')],
+        [Button.inline('📆 Buscar entre fechas', 'menu_rango')],
+        [Button.inline('⏳ Deadline próxima', 'menu_deadline')]
+    ]
+    await event.edit('¿Cómo quieres buscar proyectos Erasmus?', buttons=botones)
+
+# --- Menú “Buscar por país” ---
+@enrutador.ruta('menu_paises')
+@enrutador.ruta('mp')
+async def cb_menu_paises(event, snap, modo, pagina='0'):
+    botones = teclado_menu(snap, 'mp', snap.paises, boton_pais, int(pagina or 0))
+    await event.edit('Elige un país para ver proyectos:', buttons=botones)
+
+# --- Selección de un país ---
+@enrutador.ruta('pais')
+async def cb_pais(event, snap, modo, pais):
+    if not snap.indices_pais(pais):
+        await event.edit(f'No hay proyectos Erasmus registrados para {pais}.')
         return
-
-    # --- Selección de un mes ---
-    if data.startswith('mes_'):
-        mes = data.split('mes_', 1)[1]
-        # Convertir “July 2025” a mes normalizado “julio” y año “2025”
+    await event.edit(f'Proyectos en {pais}:', buttons=teclado_lista(snap, 'pais', pais, 0))
+
+# --- Menú “Buscar por mes” ---
+@enrutador.ruta('menu_meses')
+@enrutador.ruta('mm')
+async def cb_menu_meses(event, snap, modo, pagina='0'):
+    # Meses, etiquetas y orden vienen precalculados en el snapshot
+    botones = teclado_menu(snap, 'mm', snap.meses_menu, boton_mes, int(pagina or 0))
+    await event.edit('Elige un mes (p.ej. "July 2025") para ver proyectos:', buttons=botones)
+
+# Botones de mes antiguos, que llevaban la etiqueta: “July 2025”
+MESES_INGLES = {
+    "January": 1, "February": 2, "March": 3, "April": 4, "May": 5, "June": 6,
+    "July": 7, "August": 8, "September": 9, "October": 10, "November": 11, "December": 12
+}
+
+# --- Selección de un mes: mes_<YYYYMM> ---
+@enrutador.ruta('mes')
+async def cb_mes(event, snap, modo, mes):
+    anio_mes = decodificar_anio_mes(mes)
+    if anio_mes is None:
         partes = mes.split()
-        nombre_ingles = partes[0]
-        anio = int(partes[1])
-        # Mapeo inglés→español básico
-        map_mes_ing_es = {
-            "January": "enero", "February": "febrero", "March": "marzo",
-            "April": "abril", "May": "mayo", "June": "junio",
-            "July": "julio", "August": "agosto", "September": "septiembre",
-            "October": "octubre", "November": "noviembre", "December": "diciembre"
-        }
-        mes_es = map_mes_ing_es.get(nombre_ingles, None)
-        if not mes_es:
-            await event.edit(f'Mes inválido: {mes}.')
-            return
-
-        # Filtrar proyectos cuyo fecha_inicio está en ese mes y año
-        filtrados = []
-        for p in proyectos:
-            if p['fecha_inicio'] and p['fecha_inicio'].month == MESES_ES.index(mes_es) + 1 and p['fecha_inicio'].year == anio:
-                filtrados.append(p)
-        filtrados.sort(key=lambda x: x['fecha_inicio'] or datetime.max.date())
-
-        client._contexto[user_id] = {'modo': 'mes', 'lista': filtrados}
-        if not filtrados:
-            await event.edit(f'No hay proyectos Erasmus en {mes_es.capitalize()} {anio}.')
-            return
-        botones = [
-            [Button.inline(f"{p['titulo']} ({p['ciudad']}, {p['pais']})", f'proy_mes_{i}')]
-            for i, p in enumerate(filtrados)
-        ]
-        botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-        await event.edit(f'Proyectos en {mes_es.capitalize()} {anio}:', buttons=botones)
-        return
-
-    # --- Menú “Buscar entre fechas” ---
-    if data == 'menu_rango':
-        await event.edit(
-            'Escribe dos fechas en formato YYYY-MM-DD en un mismo mensaje.\n'
-            'Ejemplo: "entre 2025-06-01 y 2025-06-15"\n\n'
-            'Si no incluyes dos fechas válidas, no se mostrarán resultados.'
-        )
-        return
-
-    # --- Menú “Deadline próxima” ---
-    if data == 'menu_deadline':
-        proximos = filtrar_deadline_proxima(proyectos, dias=14)
-        client._contexto[user_id] = {'modo': 'deadline', 'lista': proximos}
-        if not proximos:
-            await event.edit('No hay proyectos con deadline en los próximos 14 días.')
-            return
-        botones = []
-        hoy = datetime.now().date()
-        for i, p in enumerate(proximos):
-            dias = (p['deadline'] - hoy).days
-            botones.append([
-                Button.inline(
-                    f"{p['titulo']} ({p['ciudad']}, {p['pais']}) — {dias} días",
-                    f'proy_deadline_{i}'
-                )
-            ])
-        botones.append([Button.inline('🏠 Volver al inicio', 'start')])
-        await event.edit('Proyectos con deadline próxima:', buttons=botones)
+        if len(partes) == 2 and partes[0] in MESES_INGLES and partes[1].isdigit():
+            anio_mes = int(partes[1]), MESES_INGLES[partes[0]]
+    if anio_mes is None:
+        await event.edit(f'Mes inválido: {mes}.')
         return
+    anio, num_mes = anio_mes
+    mes_es = MESES_ES[num_mes - 1].capitalize()
 
-    # —————————————————————————————————————————————————————
-    # A partir de aquí, chequeamos primero los callbacks más específicos
-    # —————————————————————————————————————————————————————
-
-    # --- Detalle de proyecto semántico por rango (modo 'rango_sem') ---
-    if data.startswith('proy_rango_sem_'):
-        if not ctx or ctx.get('modo') != 'rango_sem':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_rango')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
-        return
-
-    # --- Detalle de proyecto por rango (modo 'rango'): fechas ± país/ciudad o sólo fechas ---
-    if data.startswith('proy_rango_'):
-        if not ctx or ctx.get('modo') not in ('rango',):
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_rango')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
-        return
-
-    # --- Detalle de proyecto País+Mes semántico (modo 'pais_mes_sem') ---
-    if data.startswith('proy_pais_mes_sem_'):
-        if not ctx or ctx.get('modo') != 'pais_mes_sem':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'start')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
-        return
-
-    # --- Detalle de proyecto País+Mes (modo 'pais_mes') ---
-    if data.startswith('proy_pais_mes_'):
-        if not ctx or ctx.get('modo') != 'pais_mes':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'start')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
+    # Proyectos cuyo fecha_inicio está en ese mes y año: una consulta al índice
+    if not snap.indices_anio_mes(anio, num_mes):
+        await event.edit(f'No hay proyectos Erasmus en {mes_es} {anio}.')
         return
+    botones = teclado_lista(snap, 'mes', codificar_anio_mes(anio, num_mes), 0)
+    await event.edit(f'Proyectos en {mes_es} {anio}:', buttons=botones)
+
+# --- Menú “Buscar entre fechas” ---
+@enrutador.ruta('menu_rango')
+async def cb_menu_rango(event, snap, modo):
+    await event.edit(
+        'Escribe dos fechas en formato YYYY-MM-DD en un mismo mensaje.\n'
+        'Ejemplo: "entre 2025-06-01 y 2025-06-15"\n\n'
+        'Si no incluyes dos fechas válidas, no se mostrarán resultados.'
+    )
 
-    # --- Detalle de proyecto País semántico (modo 'pais_sem') ---
-    if data.startswith('proy_pais_sem_'):
-        if not ctx or ctx.get('modo') != 'pais_sem':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_paises')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
+# --- Menú “Deadline próxima” ---
+@enrutador.ruta('menu_deadline')
+async def cb_menu_deadline(event, snap, modo):
+    if not proximos_deadline(snap):
+        await event.edit('No hay proyectos con deadline en los próximos 14 días.')
         return
+    await event.edit('Proyectos con deadline próxima:', buttons=teclado_lista(snap, 'deadline', '', 0))
 
-    # --- Detalle de proyecto País (modo 'pais') ---
-    if data.startswith('proy_pais_') and not data.startswith('proy_pais_mes_') and not data.startswith('proy_pais_sem_'):
-        if not ctx or ctx.get('modo') != 'pais':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_paises')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
-        return
+def proximos_deadline(snap):
+    """Índices con deadline en los próximos 14 días, ordenados por deadline."""
+    hoy = datetime.now().date()
+    return snap.indices_deadline(hoy, hoy + timedelta(days=14))
 
-    # --- Detalle de proyecto Ciudad semántico (modo 'ciudad_sem') ---
-    if data.startswith('proy_ciudad_sem_'):
-        if not ctx or ctx.get('modo') != 'ciudad_sem':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_ciudades')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
-        return
+def teclado_lista(snap, modo, clave, pagina):
+    """
+    Teclado de una página de un listado que se reconstruye desde los
+    índices del catálogo: país (clave = nombre), mes (clave = YYYYMM)
+    o deadline próxima. Devuelve None si el listado no es de ese tipo.
+    """
+    if modo == 'pais':
+        indices = snap.indices_pais(clave)
+    elif modo == 'mes':
+        anio_mes = decodificar_anio_mes(clave)
+        if anio_mes is None:
+            return None
+        indices = snap.indices_anio_mes(*anio_mes)
+    elif modo == 'deadline':
+        indices = proximos_deadline(snap)
+    else:
+        return None
+    hoy = datetime.now().date()
+    return teclado_paginado(
+        indices, pagina,
+        lambda n: codificar_lista(modo, clave, n),
+        lambda i: boton_proyecto(modo, snap.proyectos[i], hoy)
+    )
 
-    # --- Detalle de proyecto Ciudad (modo 'ciudad') ---
-    if data.startswith('proy_ciudad_') and not data.startswith('proy_ciudad_sem_'):
-        if not ctx or ctx.get('modo') != 'ciudad':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_ciudades')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
+# --- Cambio de página de un listado: l:<vista>:<clave>:<pagina>[:<token>] ---
+@enrutador.ruta(PREFIJO_LISTA)
+async def cb_pagina_lista(event, snap, modo, clave='', pagina='0', token=''):
+    try:
+        pagina = int(pagina or 0)
+        if modo == 'deadline' or clave:
+            botones = teclado_lista(snap, modo, clave, pagina)
+        else:
+            # Resultados de una búsqueda libre: los IDs están en la sesión,
+            # que solo guarda el último listado; el token dice si es este
+            ctx = sesiones.obtener(str(event.sender_id))
+            if not ctx or ctx.get('modo') != modo or not token or token_lista(ctx['ids']) != token:
+                await event.answer('Contexto inválido.')
+                return
+            # Los proyectos retirados en una recarga del catálogo se omiten
+            proyectos = [p for p in map(snap.proyecto_por_id, ctx['ids']) if p is not None]
+            botones = teclado_paginado(
+                proyectos, pagina,
+                lambda n: codificar_lista(modo, '', n, token),
+                lambda p: boton_proyecto(modo, p)
+            )
+    except ValueError:
+        botones = None
+    if botones is None:
+        await event.answer('Listado no válido.')
         return
-
-    # --- Detalle de proyecto Mes semántico (modo 'mes_sem') ---
-    if data.startswith('proy_mes_sem_'):
-        if not ctx or ctx.get('modo') != 'mes_sem':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_meses')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
+    # Solo cambia el teclado; el texto del mensaje se mantiene
+    await event.edit(buttons=botones)
+
+# --- Indicador de página (no hace nada) ---
+@enrutador.ruta('noop')
+async def cb_noop(event, snap, modo, *args):
+    await event.answer()
+
+# --- Detalle de proyecto sin estado: d:<vista>:<id> ---
+@enrutador.ruta(PREFIJO_DETALLE)
+async def cb_detalle(event, snap, modo, pid_b36=''):
+    pid = decodificar_id(pid_b36)
+    proyecto = snap.proyecto_por_id(pid) if pid is not None and modo in VOLVER_POR_MODO else None
+    if proyecto is None:
+        await event.edit('Proyecto no válido.')
         return
-
-    # --- Detalle de proyecto Mes (modo 'mes') ---
-    if data.startswith('proy_mes_') and not data.startswith('proy_mes_sem_'):
-        if not ctx or ctx.get('modo') != 'mes':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [
-            [Button.inline('🔙 Volver atrás', 'menu_meses')],
-            [Button.inline('🏠 Volver al inicio', 'start')]
-        ]
-        await event.edit(texto, buttons=botones, parse_mode='html')
+    await mostrar_detalle(event, snap, proyecto, modo)
+
+# --- Botones "proy_<modo>_<i>" enviados antes de los callbacks sin estado ---
+# Se resuelven con el contexto guardado del usuario, que debe ser del mismo modo.
+@enrutador.ruta('proy')
+async def cb_proyecto_contexto(event, snap, modo, indice):
+    ctx = sesiones.obtener(str(event.sender_id))
+    if not ctx or ctx.get('modo') != modo:
+        await event.answer('Contexto inválido.')
         return
-
-    # --- Detalle de proyecto por deadline próxima ---
-    if data.startswith('proy_deadline_'):
-        if not ctx or ctx.get('modo') != 'deadline':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [[Button.inline('🏠 Volver al inicio', 'start')]]
-        await event.edit(texto, buttons=botones, parse_mode='html')
+    idx = int(indice)
+    ids = ctx['ids']
+    proyecto = snap.proyecto_por_id(ids[idx]) if 0 <= idx < len(ids) else None
+    if proyecto is None:
+        await event.edit('Proyecto no válido.')
         return
+    await mostrar_detalle(event, snap, proyecto, modo)
 
-    # --- Detalle de proyecto por búsqueda semántica (modo 'nlp') ---
-    if data.startswith('proy_nlp_'):
-        if not ctx or ctx.get('modo') != 'nlp':
-            await event.answer('Contexto inválido.')
-            return
-        idx = int(data.split('_')[-1])
-        lista = ctx['lista']
-        if idx < 0 or idx >= len(lista):
-            await event.edit('Proyecto no válido.')
-            return
-        proyecto = lista[idx]
-        texto = formatear_proyecto(proyecto, mostrar_dias_deadline=True)
-        botones = [[Button.inline('🏠 Volver al inicio', 'start')]]
-        await event.edit(texto, buttons=botones, parse_mode='html')
-        return
+# ===========================
+# MÉTRICAS PERIÓDICAS
+# ===========================
+INTERVALO_ESTADISTICAS = 15 * 60  # segundos entre volcados al log
+
+def estadisticas():
+    """Reúne las métricas de los componentes con estado del bot."""
+    return {
+        'catalogo': catalogo.estadisticas(),
+        'cache_consultas': cache_consultas.estadisticas(),
+        'agrupador_consultas': agrupador_consultas.estadisticas(),
+        'sesiones': sesiones.estadisticas(),
+        'enrutador': enrutador.estadisticas(),
+    }
+
+async def registrar_estadisticas(intervalo=INTERVALO_ESTADISTICAS):
+    """Vuelca estadisticas() al log cada 'intervalo' segundos."""
+    while True:
+        await asyncio.sleep(intervalo)
+        try:
+            for nombre, datos in estadisticas().items():
+                log.info("Estadísticas %s: %s", nombre, datos)
+        except Exception:
+            log.exception("No se pudieron recoger las estadísticas")
 
 # ===========================
 # ARRANCAR EL BOT
 # ===========================
 client.start()
-client.run_until_disconnected()
+# Se guarda la referencia para que el recolector no se lleve la tarea
+client._tarea_estadisticas = client.loop.create_task(registrar_estadisticas())
+try:
+    client.run_until_disconnected()
+finally:
+    cache_consultas.guardar()
+    sesiones.cerrar()
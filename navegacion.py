@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import time
+from array import array
+
+log = logging.getLogger(__name__)
+
+# ===========================
+# CALLBACKS SIN ESTADO
+# ===========================
+# Telegram limita 'callback_data' a 64 bytes. Para los detalles de proyecto
+# usamos "d:<vista>:<id en base 36>": el ID estable del proyecto (63 bits,
+# como mucho 13 caracteres) y un token corto con la vista de origen, que
+# decide el botón "Volver atrás". Así el detalle se sirve directamente desde
+# el catálogo, sin consultar el contexto del usuario, y cualquier proceso
+# del bot puede responder al botón.
+MAX_CALLBACK_DATA = 64
+PREFIJO_DETALLE = 'd'
+
+# modo -> token de vista (y al revés)
+VISTAS = {
+    'pais': 'p', 'pais_sem': 'ps',
+    'ciudad': 'c', 'ciudad_sem': 'cs',
+    'mes': 'm', 'mes_sem': 'ms',
+    'pais_mes': 'pm', 'pais_mes_sem': 'pms',
+    'rango': 'r', 'rango_sem': 'rs',
+    'deadline': 'dl', 'nlp': 'n',
+}
+MODOS_POR_VISTA = {v: k for k, v in VISTAS.items()}
+
+_DIGITOS36 = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def a_base36(n):
+    if n == 0:
+        return '0'
+    cifras = []
+    while n:
+        n, r = divmod(n, 36)
+        cifras.append(_DIGITOS36[r])
+    return ''.join(reversed(cifras))
+
+
+def codificar_detalle(modo, pid):
+    """callback_data compacto para ver el proyecto 'pid' desde la vista 'modo'."""
+    data = f"{PREFIJO_DETALLE}:{VISTAS[modo]}:{a_base36(pid)}"
+    assert len(data.encode()) <= MAX_CALLBACK_DATA
+    return data
+
+
+def decodificar_id(texto):
+    """ID de proyecto a partir de su forma en base 36, o None si no es válida."""
+    try:
+        return int(texto, 36)
+    except ValueError:
+        return None
+
+
+# ===========================
+# PAGINACIÓN
+# ===========================
+# Los listados y menús se envían por páginas de TAM_PAGINA botones. La página
+# viaja en el propio callback_data:
+#   "l:<vista>:<clave>:<pagina>"  listado (clave = país, YYYYMM...)
+#   "l:<vista>::<pagina>:<token>" listado guardado en la sesión del usuario;
+#                                 'token' identifica esa lista (ver token_lista)
+#   "mp::<pagina>" / "mm::<pagina>"  menús de países y de meses
+#   "mes_<YYYYMM>"                   un mes del menú de meses
+TAM_PAGINA = 8
+PREFIJO_LISTA = 'l'
+
+
+def paginar(total, pagina, tam=TAM_PAGINA):
+    """
+    Devuelve (inicio, fin, pagina, n_paginas) para mostrar la página
+    'pagina' (se ajusta al rango válido) de una lista de 'total' elementos.
+    """
+    n_paginas = max(1, -(-total // tam))
+    pagina = min(max(pagina, 0), n_paginas - 1)
+    inicio = pagina * tam
+    return inicio, min(inicio + tam, total), pagina, n_paginas
+
+
+def codificar_lista(modo, clave, pagina, token=''):
+    """callback_data de la página 'pagina' del listado 'modo'/'clave' (o 'token')."""
+    data = f"{PREFIJO_LISTA}:{VISTAS[modo]}:{clave}:{pagina}"
+    return f"{data}:{token}" if token else data
+
+
+def token_lista(ids):
+    """
+    Token corto (base 36) de una lista de IDs de proyecto. La sesión solo
+    guarda el último listado del usuario: comparando el token del botón con
+    el de la sesión, los botones de un listado anterior no muestran otro.
+    """
+    resumen = hashlib.blake2b(array('q', ids).tobytes(), digest_size=5).digest()
+    return a_base36(int.from_bytes(resumen, 'big'))
+
+
+def codificar_anio_mes(anio, mes):
+    """Clave compacta YYYYMM de un mes en los callbacks."""
+    return f"{anio:04d}{mes:02d}"
+
+
+def decodificar_anio_mes(clave):
+    """(año, mes) a partir de una clave YYYYMM, o None si no es válida."""
+    if len(clave) != 6 or not clave.isdigit():
+        return None
+    anio, mes = int(clave[:4]), int(clave[4:])
+    if not 1 <= mes <= 12:
+        return None
+    return anio, mes
+
+# ===========================
+# ENRUTADOR DE CALLBACKS
+# ===========================
+class Enrutador:
+    """
+    Tabla de rutas para los botones. analizar() convierte 'callback_data'
+    una sola vez en (accion, modo, args) y despachar() llama al handler
+    registrado para esa acción con una búsqueda en diccionario, sin
+    recorrer una cadena de startswith. Formatos reconocidos:
+      - "menu_paises", "start", ...   -> acción exacta, sin argumentos
+      - "a:<vista>:<arg>..."           -> acción 'a', modo de la vista y args
+      - "proy_<modo>_<i>" (antiguo)    -> ('proy', modo, (i,))
+      - "<accion>_<resto>"             -> (accion, None, (resto,))
+    Mide además el tiempo de cada ruta (llamadas, total y máximo en ms).
+    """
+
+    def __init__(self):
+        self._rutas = {}
+        self._tiempos = {}  # accion -> [llamadas, total_ms, max_ms]
+
+    def ruta(self, accion):
+        """Decorador: registra el handler async(event, snap, modo, *args) de 'accion'."""
+        def registrar(handler):
+            self._rutas[accion] = handler
+            return handler
+        return registrar
+
+    def analizar(self, data):
+        if data in self._rutas:
+            return data, None, ()
+        if ':' in data:
+            partes = data.split(':')
+            vista = partes[1] if len(partes) > 1 else ''
+            return partes[0], MODOS_POR_VISTA.get(vista, vista or None), tuple(partes[2:])
+        accion, _, resto = data.partition('_')
+        if accion == 'proy':
+            modo, _, indice = resto.rpartition('_')
+            return accion, modo, (indice,)
+        return accion, None, (resto,)
+
+    async def despachar(self, event, data, snap):
+        """Ejecuta la ruta de 'data'. Devuelve False si no hay ninguna registrada."""
+        accion, modo, args = self.analizar(data)
+        handler = self._rutas.get(accion)
+        if handler is None:
+            log.debug("Callback sin ruta: %r", data)
+            return False
+        t0 = time.perf_counter()
+        try:
+            await handler(event, snap, modo, *args)
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            t = self._tiempos.setdefault(accion, [0, 0.0, 0.0])
+            t[0] += 1
+            t[1] += ms
+            t[2] = max(t[2], ms)
+        return True
+
+    def estadisticas(self):
+        """Por ruta: llamadas, media y máximo en milisegundos."""
+        return {
+            accion: {'llamadas': n, 'media_ms': round(total / n, 3), 'max_ms': round(maximo, 3)}
+            for accion, (n, total, maximo) in self._tiempos.items()
+        }
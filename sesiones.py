@@ -0,0 +1,234 @@
+import logging
+import sqlite3
+import sys
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# ===========================
+# CONTEXTO DE NAVEGACIÓN POR USUARIO (acotado y con caducidad)
+# ===========================
+# Bytes aproximados que ocupa una sesión además de sus IDs (dict, claves, etc.)
+BYTES_BASE_SESION = 400
+
+
+class AlmacenSesiones:
+    """
+    Backend en memoria. Guarda para cada user_id el último listado que se le mostró:
+    {'modo': <modo>, 'ids': array de IDs estables de proyecto}.
+    Se guardan IDs (8 bytes cada uno) en lugar de copias de los proyectos.
+
+    Las sesiones se ordenan por último uso (LRU) y se expulsan cuando:
+      - llevan más de 'ttl' segundos sin usarse,
+      - hay más de 'max_sesiones',
+      - o la memoria estimada supera 'max_bytes'.
+    """
+
+    def __init__(self, max_sesiones=10_000, ttl=6 * 3600, max_bytes=16 * 1024 * 1024):
+        self.max_sesiones = max_sesiones
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._sesiones = OrderedDict()  # user_id -> (ultimo_uso, modo, ids)
+        self._bytes = 0
+        self.expulsiones = 0
+        self.caducadas = 0
+
+    @staticmethod
+    def _tamano(ids):
+        return BYTES_BASE_SESION + sys.getsizeof(ids)
+
+    def guardar(self, user_id, modo, ids):
+        """Sustituye el listado de 'user_id' por 'ids' en el modo dado."""
+        if user_id in self._sesiones:
+            self._quitar(user_id)
+        ids = array('q', ids)
+        self._sesiones[user_id] = (time.monotonic(), modo, ids)
+        self._bytes += self._tamano(ids)
+        self._purgar()
+
+    def obtener(self, user_id):
+        """Devuelve {'modo', 'ids'} o None si no hay sesión (o ha caducado)."""
+        entrada = self._sesiones.get(user_id)
+        if entrada is None:
+            return None
+        ultimo_uso, modo, ids = entrada
+        ahora = time.monotonic()
+        if ahora - ultimo_uso > self.ttl:
+            self._quitar(user_id)
+            self.caducadas += 1
+            return None
+        self._sesiones[user_id] = (ahora, modo, ids)
+        self._sesiones.move_to_end(user_id)
+        return {'modo': modo, 'ids': ids}
+
+    def borrar(self, user_id):
+        if user_id in self._sesiones:
+            self._quitar(user_id)
+
+    def _quitar(self, user_id):
+        _, _, ids = self._sesiones.pop(user_id)
+        self._bytes -= self._tamano(ids)
+
+    def _purgar(self):
+        """Expulsa por la cola LRU las caducadas y lo que exceda los límites."""
+        ahora = time.monotonic()
+        while self._sesiones:
+            user_id, (ultimo_uso, _, _) = next(iter(self._sesiones.items()))
+            if ahora - ultimo_uso > self.ttl:
+                self.caducadas += 1
+            elif len(self._sesiones) > self.max_sesiones or self._bytes > self.max_bytes:
+                self.expulsiones += 1
+            else:
+                break
+            self._quitar(user_id)
+
+    def cerrar(self):
+        """Nada que liberar en memoria; los backends persistentes vuelcan aquí."""
+
+    def __len__(self):
+        return len(self._sesiones)
+
+    def estadisticas(self):
+        return {
+            'sesiones_activas': len(self._sesiones),
+            'bytes_estimados': self._bytes,
+            'expulsiones': self.expulsiones,
+            'caducadas': self.caducadas,
+        }
+
+
+# ===========================
+# BACKEND PERSISTENTE (SQLite en modo WAL)
+# ===========================
+class AlmacenSesionesSQLite(AlmacenSesiones):
+    """
+    Igual que AlmacenSesiones, pero las sesiones sobreviven a reinicios:
+    la memoria actúa de caché LRU y cada cambio se anota como pendiente.
+    Un hilo aparte vuelca los pendientes a SQLite (WAL) en una sola
+    transacción cada 'intervalo_escritura' segundos, fuera del camino de
+    los handlers. Solo las sesiones que no están en memoria se leen de disco.
+    """
+
+    def __init__(self, ruta='sesiones.db', intervalo_escritura=0.5, **kwargs):
+        super().__init__(**kwargs)
+        self.ruta = ruta
+        self.intervalo_escritura = intervalo_escritura
+        self._pendientes = {}  # user_id -> ('guardar', modo, blob, instante) | ('tocar', instante) | ('borrar',)
+        self._lock = threading.Lock()
+        self._parar = threading.Event()
+        self.lecturas_disco = 0
+        self.volcados = 0
+
+        self._lector = self._conectar()
+        self._lector.execute(
+            "CREATE TABLE IF NOT EXISTS sesiones ("
+            " user_id TEXT PRIMARY KEY, modo TEXT NOT NULL,"
+            " ids BLOB NOT NULL, ultimo_uso REAL NOT NULL)"
+        )
+        self._lector.commit()
+        self._hilo = threading.Thread(target=self._bucle_escritura, name='sesiones-sqlite', daemon=True)
+        self._hilo.start()
+
+    def _conectar(self):
+        con = sqlite3.connect(self.ruta, check_same_thread=False)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        return con
+
+    # ---------------------------
+    # Operaciones (hilo del bot)
+    # ---------------------------
+    def guardar(self, user_id, modo, ids):
+        super().guardar(user_id, modo, ids)
+        ids = self._sesiones[user_id][2]
+        with self._lock:
+            self._pendientes[user_id] = ('guardar', modo, ids.tobytes(), time.time())
+
+    def borrar(self, user_id):
+        super().borrar(user_id)
+        with self._lock:
+            self._pendientes[user_id] = ('borrar',)
+
+    def obtener(self, user_id):
+        ctx = super().obtener(user_id)
+        if ctx is not None:
+            with self._lock:
+                if user_id not in self._pendientes:
+                    self._pendientes[user_id] = ('tocar', time.time())
+            return ctx
+
+        with self._lock:
+            pendiente = self._pendientes.get(user_id)
+        if pendiente is not None and pendiente[0] == 'borrar':
+            return None
+        if pendiente is not None and pendiente[0] == 'guardar':
+            _, modo, blob, instante = pendiente
+        else:
+            self.lecturas_disco += 1
+            fila = self._lector.execute(
+                "SELECT modo, ids, ultimo_uso FROM sesiones WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            if fila is None:
+                return None
+            modo, blob, instante = fila
+        if time.time() - instante > self.ttl:
+            self.caducadas += 1
+            return None
+        ids = array('q')
+        ids.frombytes(blob)
+        AlmacenSesiones.guardar(self, user_id, modo, ids)
+        return {'modo': modo, 'ids': self._sesiones[user_id][2]}
+
+    # ---------------------------
+    # Escritura en segundo plano
+    # ---------------------------
+    def _bucle_escritura(self):
+        escritor = self._conectar()
+        try:
+            while not self._parar.wait(self.intervalo_escritura):
+                self._volcar(escritor)
+            self._volcar(escritor)
+        finally:
+            escritor.close()
+
+    def _volcar(self, con):
+        with self._lock:
+            pendientes, self._pendientes = self._pendientes, {}
+        guardar, tocar, borrar = [], [], []
+        for user_id, op in pendientes.items():
+            if op[0] == 'guardar':
+                guardar.append((user_id, op[1], op[2], op[3]))
+            elif op[0] == 'tocar':
+                tocar.append((op[1], user_id))
+            else:
+                borrar.append((user_id,))
+        try:
+            with con:
+                if guardar:
+                    con.executemany("INSERT OR REPLACE INTO sesiones VALUES (?, ?, ?, ?)", guardar)
+                if tocar:
+                    con.executemany("UPDATE sesiones SET ultimo_uso = ? WHERE user_id = ?", tocar)
+                if borrar:
+                    con.executemany("DELETE FROM sesiones WHERE user_id = ?", borrar)
+                if self.volcados % 100 == 0:
+                    con.execute("DELETE FROM sesiones WHERE ultimo_uso < ?", (time.time() - self.ttl,))
+            self.volcados += 1
+        except sqlite3.Error:
+            log.exception("No se pudieron guardar %d sesiones en %s", len(pendientes), self.ruta)
+
+    def cerrar(self):
+        """Vuelca lo pendiente y detiene el hilo de escritura."""
+        self._parar.set()
+        self._hilo.join()
+        self._lector.close()
+
+    def estadisticas(self):
+        datos = super().estadisticas()
+        with self._lock:
+            datos['escrituras_pendientes'] = len(self._pendientes)
+        datos['lecturas_disco'] = self.lecturas_disco
+        datos['volcados'] = self.volcados
+        return datos
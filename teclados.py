@@ -0,0 +1,57 @@
+from datetime import datetime
+
+from telethon.tl.custom import Button
+
+from navegacion import codificar_anio_mes, codificar_detalle, paginar
+
+# ===========================
+# TECLADOS PAGINADOS
+# ===========================
+def boton_proyecto(modo, p, hoy=None):
+    """Botón de un proyecto dentro de un listado; abre su detalle sin estado."""
+    if modo == 'pais':
+        etiqueta = f"{p.titulo} ({p.ciudad})"
+    elif modo == 'deadline':
+        dias = (p.deadline - (hoy or datetime.now().date())).days
+        etiqueta = f"{p.titulo} ({p.ciudad}, {p.pais}) — {dias} días"
+    else:
+        etiqueta = f"{p.titulo} ({p.ciudad}, {p.pais})"
+    return Button.inline(etiqueta, codificar_detalle(modo, p.id))
+
+def teclado_paginado(elementos, pagina, data_pagina, boton):
+    """
+    Teclado con la página 'pagina' de 'elementos' (solo se construyen los
+    botones de esa página), fila Anterior/Siguiente si hace falta y botón
+    de inicio. 'boton(elemento)' crea cada botón y 'data_pagina(n)' el
+    callback_data de la página n.
+    """
+    inicio, fin, pagina, n_paginas = paginar(len(elementos), pagina)
+    botones = [[boton(e)] for e in elementos[inicio:fin]]
+    if n_paginas > 1:
+        nav = []
+        if pagina > 0:
+            nav.append(Button.inline('⬅️ Anterior', data_pagina(pagina - 1)))
+        nav.append(Button.inline(f'{pagina + 1}/{n_paginas}', 'noop'))
+        if pagina < n_paginas - 1:
+            nav.append(Button.inline('Siguiente ➡️', data_pagina(pagina + 1)))
+        botones.append(nav)
+    botones.append([Button.inline('🏠 Volver al inicio', 'start')])
+    return botones
+
+def teclado_menu(snap, menu, elementos, boton, pagina):
+    """
+    Página 'pagina' del menú 'menu' ('mp' países, 'mm' meses). Solo depende
+    del catálogo, así que se construye una vez por snapshot y página.
+    """
+    pagina = paginar(len(elementos), pagina)[2]
+    return snap.memo((menu, pagina), lambda: teclado_paginado(
+        elementos, pagina, lambda n: f'{menu}::{n}', boton
+    ))
+
+# Botones de los menús de países y de meses (elementos de snap.paises y snap.meses_menu)
+def boton_pais(pais):
+    return Button.inline(pais, f'pais_{pais}')
+
+def boton_mes(mes):
+    anio, num_mes, etiqueta = mes
+    return Button.inline(etiqueta, f'mes_{codificar_anio_mes(anio, num_mes)}')
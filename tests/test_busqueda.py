@@ -0,0 +1,89 @@
+"""
+Búsqueda léxica (BM25) y fusión de rankings.
+"""
+import os
+
+import numpy as np
+import pytest
+
+from busqueda import IndiceBM25, MotorBusqueda, fusion_rrf, indice_lexico, terminos
+from catalogo import Catalogo
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_terminos_sin_palabras_vacias():
+    assert terminos("Busco un proyecto de fotografía en la montaña") == ['fotografia', 'montana']
+
+
+@pytest.fixture
+def indice():
+    return IndiceBM25([
+        terminos("taller de fotografía analógica"),
+        terminos("fotografía de naturaleza y montaña"),
+        terminos("voluntariado con animales en la montaña"),
+        terminos("intercambio juvenil sobre teatro"),
+    ] + [terminos("voluntariado juvenil")] * 20)
+
+
+def test_buscar_ordena_por_puntuacion(indice):
+    assert indice.buscar(['fotografia', 'analogica'], fraccion=0.0) == [0, 1]
+    # Por defecto se descarta lo que no llega a la mitad del mejor
+    assert indice.buscar(['fotografia', 'analogica']) == [0]
+    assert indice.buscar(['inexistente']) == []
+
+
+def test_buscar_umbral_relativo(indice):
+    # 'montana' y 'fotografia' solo coinciden a medias con el mejor; con
+    # fracción 1 solo queda el que tiene los dos términos
+    assert indice.buscar(['fotografia', 'montana'], fraccion=1.0) == [1]
+    assert set(indice.buscar(['fotografia', 'montana'], fraccion=0.0)) == {0, 1, 2}
+
+
+def test_buscar_umbral_absoluto(indice):
+    # 'voluntariado' aparece en casi todas las filas: su puntuación no llega al mínimo
+    assert indice.buscar(['voluntariado']) == []
+    assert indice.buscar(['voluntariado'], minimo=0.0, top_k=3) != []
+
+
+def test_buscar_en_filas(indice):
+    assert indice.buscar(['fotografia'], filas=[1, 3]) == [1]
+
+
+def test_fusion_rrf():
+    assert fusion_rrf([1, 2, 3], [3, 1]) == [1, 3, 2]
+    assert fusion_rrf([], [4, 5]) == [4, 5]
+
+
+def test_indice_lexico_por_snapshot():
+    snap = Catalogo(os.path.join(RAIZ, 'erasmus_projects.csv')).actual()
+    indice = indice_lexico(snap)
+    assert indice.n == len(snap)
+    assert indice_lexico(snap) is indice
+
+
+@pytest.mark.parametrize('precision, dim', [('int8', None), ('float16', None), ('int8', 48)])
+def test_matriz_compacta_da_los_mismos_resultados(precision, dim):
+    rng = np.random.default_rng(0)
+    # Grupos de vectores parecidos, para que haya resultados sobre el umbral de 0.7
+    centros = rng.standard_normal((40, 64)).astype(np.float32)
+    embeddings = (np.repeat(centros, 50, axis=0)
+                  + 0.4 * rng.standard_normal((2000, 64)).astype(np.float32))
+    exacto = MotorBusqueda(embeddings)
+    compacto = MotorBusqueda(embeddings, precision=precision, dim=dim)
+    assert compacto.compacto
+
+    consultas = centros[:10] + 0.3 * rng.standard_normal((10, 64)).astype(np.float32)
+    filas = np.arange(0, 2000, 3)
+    for q in consultas:
+        assert compacto.buscar(q) == exacto.buscar(q)
+        assert compacto.buscar(q, limitar=False) == exacto.buscar(q, limitar=False)
+        assert compacto.buscar(q, filas=filas) == exacto.buscar(q, filas=filas)
+    # Sin nada sobre el umbral, los top_k más similares
+    lejana = rng.standard_normal(64).astype(np.float32)
+    assert compacto.buscar(lejana, umbral=0.99) == exacto.buscar(lejana, umbral=0.99)
+
+
+def test_precision_no_soportada():
+    with pytest.raises(ValueError):
+        MotorBusqueda(np.eye(4, dtype=np.float32), precision='int4')
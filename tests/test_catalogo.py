@@ -0,0 +1,31 @@
+"""
+Extracción de entidades de un mensaje libre (países, ciudades, meses y fechas).
+"""
+import pytest
+
+from catalogo import ExtractorEntidades
+
+
+@pytest.fixture(scope='module')
+def extractor():
+    return ExtractorEntidades(['España', 'Países Bajos'], ['Nueva York', 'Roma'])
+
+
+def test_nombres_de_varias_palabras(extractor):
+    r = extractor.extraer("Voluntariado en Nueva York o en los paises bajos")
+    assert r['ciudades'] == ['Nueva York']
+    assert r['paises'] == ['Países Bajos']
+    assert r['palabras'] == ['voluntariado', 'los']
+
+
+def test_meses_por_palabra_completa(extractor):
+    assert extractor.extraer("la mayoría empieza en MAYO")['meses'] == ['mayo']
+    assert extractor.extraer("la mayoría de los proyectos")['meses'] == []
+
+
+def test_fechas_iso_en_el_mensaje_crudo(extractor):
+    r = extractor.extraer("roma 2025-06-01y2025-07-01")
+    assert r['fechas'] == ['2025-06-01', '2025-07-01']
+    assert r['ciudades'] == ['Roma']
+    assert r['palabras'] == []
+    assert extractor.extraer("desde:2025-06-01,hasta 2025-07-01.")['fechas'] == ['2025-06-01', '2025-07-01']
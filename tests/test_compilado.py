@@ -0,0 +1,57 @@
+"""
+Catálogo compilado (.snap): leerlo debe dar el mismo Snapshot que el CSV.
+"""
+import os
+import shutil
+
+import numpy as np
+
+from catalogo import CAMPOS_TEXTO, Catalogo, Snapshot, cargar_todos_los_proyectos
+from compilado import cargar_compilado, compilar
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CSV = os.path.join(RAIZ, 'erasmus_projects.csv')
+
+INDICES = ('paises', 'ciudades', 'por_pais', 'por_ciudad', 'por_mes', 'por_anio_mes',
+           'meses_menu', 'orden_inicio', 'ordinales_inicio', 'orden_deadline', 'ordinales_deadline',
+           'por_id')
+
+
+def assert_snapshots_iguales(a, b):
+    assert len(a) == len(b) > 0
+    for p, q in zip(a.proyectos, b.proyectos):
+        for campo in CAMPOS_TEXTO + ('ord_inicio', 'ord_fin', 'ord_deadline', 'idx', 'id'):
+            assert getattr(p, campo) == getattr(q, campo), campo
+    for nombre in INDICES:
+        assert getattr(a, nombre) == getattr(b, nombre), nombre
+
+
+def test_ida_y_vuelta(tmp_path):
+    original = Snapshot(cargar_todos_los_proyectos(CSV), 1, None)
+    embeddings = np.random.default_rng(0).standard_normal((len(original), 8)).astype(np.float32)
+    destino = str(tmp_path / 'catalogo.snap')
+    compilar(original, destino, embeddings, modelo='modelo-prueba')
+
+    leido = cargar_compilado(destino, 2, None)
+    assert_snapshots_iguales(original, leido)
+    assert leido.modelo_embeddings == 'modelo-prueba'
+    np.testing.assert_array_equal(leido.embeddings, embeddings)
+
+
+def test_sin_embeddings(tmp_path):
+    original = Snapshot(cargar_todos_los_proyectos(CSV), 1, None)
+    destino = str(tmp_path / 'catalogo.snap')
+    compilar(original, destino)
+    leido = cargar_compilado(destino, 2, None)
+    assert leido.embeddings is None and leido.modelo_embeddings is None
+
+
+def test_catalogo_prefiere_el_compilado(tmp_path):
+    csv = str(tmp_path / 'proyectos.csv')
+    shutil.copy(CSV, csv)
+    desde_csv = Catalogo(csv).actual()
+    compilar(desde_csv, str(tmp_path / 'proyectos.snap'), np.zeros((len(desde_csv), 4)))
+    desde_snap = Catalogo(csv).actual()
+    # Solo el compilado trae la matriz de embeddings
+    assert desde_csv.embeddings is None and desde_snap.embeddings is not None
+    assert_snapshots_iguales(desde_csv, desde_snap)
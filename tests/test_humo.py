@@ -0,0 +1,59 @@
+"""
+Prueba de humo: recorre con el catálogo real los caminos que usa el bot
+al pulsar botones (fichas de detalle y menús paginados) y al filtrar un
+mensaje libre, sin Telegram.
+"""
+import os
+
+import pytest
+
+from catalogo import Catalogo, filtrar_consulta
+from fichas import ficha_proyecto
+from navegacion import TAM_PAGINA
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def snap():
+    snap = Catalogo(os.path.join(RAIZ, 'erasmus_projects.csv')).actual()
+    assert len(snap) > 0
+    return snap
+
+
+def test_memo(snap):
+    llamadas = []
+    construir = lambda: llamadas.append(1) or 'valor'  # noqa: E731
+    assert snap.memo('prueba', construir) == 'valor'
+    assert snap.memo('prueba', construir) == 'valor'
+    assert llamadas == [1]
+
+
+def test_ficha_proyecto(snap):
+    for p in snap.proyectos:
+        ficha = ficha_proyecto(snap, p)
+        assert p.titulo in ficha
+        # La segunda vez sale de la caché del snapshot
+        assert ficha_proyecto(snap, p) == ficha
+    assert ('ficha', snap.proyectos[0].idx) in snap.cache
+
+
+def test_filtrar_consulta(snap):
+    p = snap.proyectos[0]
+    modo, indices, ambito = filtrar_consulta(snap, snap.extractor.extraer(f"proyectos en {p.pais}"))
+    assert modo == 'pais' and p.idx in indices and p.pais in ambito
+    assert filtrar_consulta(snap, snap.extractor.extraer("zzzz")) is None
+
+
+def test_teclado_menu(snap):
+    pytest.importorskip('telethon')
+    from teclados import boton_mes, boton_pais, teclado_menu
+
+    for menu, elementos, boton in (('mp', snap.paises, boton_pais), ('mm', snap.meses_menu, boton_mes)):
+        n_paginas = -(-len(elementos) // TAM_PAGINA)
+        for pagina in range(n_paginas):
+            botones = teclado_menu(snap, menu, elementos, boton, pagina)
+            assert botones[-1][0].data == b'start'
+            assert teclado_menu(snap, menu, elementos, boton, pagina) is botones
+        # Una página fuera de rango se ajusta a la última
+        assert teclado_menu(snap, menu, elementos, boton, n_paginas + 5) is botones
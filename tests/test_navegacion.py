@@ -0,0 +1,62 @@
+"""
+Formato de los 'callback_data' y su análisis en el enrutador.
+"""
+import pytest
+
+from navegacion import (
+    Enrutador, codificar_detalle, codificar_lista, decodificar_id, paginar, token_lista,
+)
+
+
+@pytest.fixture
+def enrutador():
+    enrutador = Enrutador()
+
+    @enrutador.ruta('start')
+    async def cb_start(event, snap, modo):
+        pass
+
+    return enrutador
+
+
+def test_accion_exacta(enrutador):
+    assert enrutador.analizar('start') == ('start', None, ())
+
+
+def test_boton_antiguo_con_modo_compuesto(enrutador):
+    assert enrutador.analizar('proy_pais_mes_3') == ('proy', 'pais_mes', ('3',))
+    assert enrutador.analizar('proy_nlp_0') == ('proy', 'nlp', ('0',))
+
+
+def test_argumento_con_espacios(enrutador):
+    assert enrutador.analizar('mes_July 2025') == ('mes', None, ('July 2025',))
+    assert enrutador.analizar('pais_Países Bajos') == ('pais', None, ('Países Bajos',))
+
+
+def test_detalle_ida_y_vuelta(enrutador):
+    pid = 2 ** 63 - 1
+    data = codificar_detalle('pais_mes_sem', pid)
+    accion, modo, (texto_id,) = enrutador.analizar(data)
+    assert (accion, modo) == ('d', 'pais_mes_sem')
+    assert decodificar_id(texto_id) == pid
+    assert decodificar_id('no válido') is None
+
+
+def test_lista_con_token(enrutador):
+    token = token_lista([5, 8, 13])
+    data = codificar_lista('nlp', '', 1, token)
+    assert data == f'l:n::1:{token}'
+    assert enrutador.analizar(data) == ('l', 'nlp', ('', '1', token))
+    assert enrutador.analizar('l:n::1:tok') == ('l', 'nlp', ('', '1', 'tok'))
+    assert enrutador.analizar('l:p:Italia:2') == ('l', 'pais', ('Italia', '2'))
+
+
+def test_token_distingue_listas():
+    assert token_lista([1, 2, 3]) == token_lista([1, 2, 3])
+    assert token_lista([1, 2, 3]) != token_lista([3, 2, 1])
+
+
+def test_paginar_ajusta_la_pagina():
+    assert paginar(25, 1, tam=10) == (10, 20, 1, 3)
+    assert paginar(25, 9, tam=10) == (20, 25, 2, 3)
+    assert paginar(0, 0, tam=10) == (0, 0, 0, 1)
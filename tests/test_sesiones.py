@@ -0,0 +1,44 @@
+"""
+Sesiones de navegación guardadas en SQLite: deben sobrevivir a un reinicio.
+"""
+from sesiones import AlmacenSesionesSQLite
+
+
+def abrir(ruta):
+    return AlmacenSesionesSQLite(str(ruta), intervalo_escritura=0.01, ttl=3600)
+
+
+def test_sesion_se_recupera_tras_reiniciar(tmp_path):
+    ruta = tmp_path / 'sesiones.db'
+    almacen = abrir(ruta)
+    almacen.guardar('42', 'pais', [7, 3, 9])
+    almacen.cerrar()
+
+    almacen = abrir(ruta)
+    try:
+        ctx = almacen.obtener('42')
+        assert ctx['modo'] == 'pais'
+        assert list(ctx['ids']) == [7, 3, 9]
+        assert almacen.lecturas_disco == 1
+        assert almacen.obtener('otro') is None
+    finally:
+        almacen.cerrar()
+
+
+def test_borrar_persiste_tras_reiniciar(tmp_path):
+    ruta = tmp_path / 'sesiones.db'
+    almacen = abrir(ruta)
+    almacen.guardar('42', 'nlp', [1, 2])
+    almacen.cerrar()
+
+    almacen = abrir(ruta)
+    almacen.borrar('42')
+    # Volcado o aún pendiente, el borrado manda sobre lo que había en disco
+    assert almacen.obtener('42') is None
+    almacen.cerrar()
+
+    almacen = abrir(ruta)
+    try:
+        assert almacen.obtener('42') is None
+    finally:
+        almacen.cerrar()